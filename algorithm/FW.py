@@ -6,6 +6,7 @@ Created on Wed Aug  7 11:08:09 2019
 """
 import numpy as np
 import algorithm.dynamic_programming as dp
+import util.profiler as pf
 
 def localFW(x0, p0, P, gradF, maxIterations = 5 ):
     it = 1;
@@ -33,33 +34,290 @@ def localSubproblem(gradient, p0, P):
     xNext[int(policy)] = p0;
     return V, xNext; 
     
-def FW_dict(game, max_error, max_iterations, initial_density=None, verbose=True):
+def exact_step(gradient, direction, hessian_direction, max_step=1.):
+    """ Exact line search step for a quadratic potential along direction,
+    clipped to [0, max_step].
     
-    y_list = [game.get_density() 
-              if initial_density is None else initial_density]
-    obj_list = [game.get_potential(y_list[0])]
-    grad_list = [game.get_gradient(y_list[0])]
+    Args:
+        gradient: gradient of the potential at the current iterate.
+        direction: direction of the step, e.g. vertex - current iterate.
+        hessian_direction: the Hessian of the potential applied to direction.
+        max_step: largest feasible step along direction.
+    Returns:
+        step: the minimizer of the potential on the segment.
+    """
+    decrease = -np.sum(gradient * direction)
+    curvature = np.sum(direction * hessian_direction)
+    if curvature <= 0:
+        return max_step if decrease > 0 else 0.
+    return min(max(decrease / curvature, 0.), max_step)
+
+def FW_dict(game, max_error, max_iterations, initial_density=None, verbose=True,
+            keep_history=True, callback=None, checkpoint_every=1, 
+            step_rule='open_loop', backend='numpy', profiler=None):
+    """ Frank-Wolfe for the queued game. Densities are lists of T dicts 
+    {(s,a): d_tsa}; internally the iterates are (T, SA) arrays indexed by 
+    game.compiled.sa_index.
+    
+    Args:
+        keep_history: bool. If False, only the current and previous iterates
+            are kept so that memory does not grow with the iterations.
+        callback: function callback(k, y_k, obj_k) called every 
+            checkpoint_every iterations with the (T, SA) iterate y_k and its
+            potential value obj_k.
+        checkpoint_every: int. Number of iterations between callbacks.
+        step_rule: 'open_loop' for the step 2/(1+k), or 'exact' for the 
+            exact line search on the quadratic potential 
+            0.5 R y^2 + C y + tolls. With 'exact', the error is the 
+            Frank-Wolfe gap <grad, y_k - vertex>.
+        backend: 'numpy' or 'numba', the backend of the value iteration and 
+            density retrieval, see algorithm.numba_backend. The numba 
+            kernels reuse the same buffers in every iteration.
+        profiler: util.profiler.profiler. Times the phases 'setup' (initial
+            density, potential and buffers), 'gradient', 'bellman backup',
+            'retrieval', 'convex combination', 'error' and 'conversion' (the
+            iterates to density dicts), and counts the 'oracle calls'.
+    Returns:
+        y_list: list of iterates, each a list of T density dicts. Holds only
+            the last two iterates if keep_history is False.
+        obj_list: list of potential values, one per iterate.
+    """
+    mdp = game.compiled
+    prof = pf.get(profiler)
+    with prof.phase('setup'):
+        if initial_density is None:
+            initial_density = game.get_density()
+        if not isinstance(initial_density, np.ndarray):
+            initial_density = mdp.sa_array(initial_density)
+        y_list = [initial_density]
+        obj_list = [game.get_potential(y_list[0])]
+        vi_out = density_out = None
+        if backend == 'numba':
+            T = initial_density.shape[0]
+            vi_out = (np.zeros((T, mdp.S)), 
+                      np.zeros((T, mdp.S), dtype=np.int64))
+            density_out = (np.zeros((T, mdp.SA)), np.zeros((T+1, mdp.S)))
     k = 1
     err = max_error *2
     while k <= max_iterations and  abs(err) > max_error:
         y_k = y_list[-1]
-        obj_list.append(game.get_potential(y_k))
-        grad_list.append(game.get_gradient(y_k))
-        V_k, pol_k = dp.value_iteration_dict(grad_list[-1], game.forward_P)
-        sa_k, s_k = dp.density_retrieval(pol_k, game)
-        step = 2 / (1+k)
-        next_y = [{sa: step*d_t[sa] + (1-step)*y_t[sa] for sa in y_t.keys()}
-                  for d_t, y_t in zip(sa_k, y_list[-1])]
-        y_list.append(next_y)
+        with prof.phase('gradient'):
+            grad_k = game.get_gradient(y_k)
+        V_k, pol_k = dp.value_iteration_dict(grad_k, mdp, backend=backend, 
+                                             out=vi_out, profiler=profiler)
+        sa_k, s_k = dp.density_retrieval(pol_k, game, backend=backend, 
+                                         out=density_out, profiler=profiler)
+        prof.count('oracle calls')
+        with prof.phase('convex combination'):
+            direction = sa_k - y_k
+            if step_rule == 'exact':
+                step = exact_step(grad_k, direction, game.R * direction)
+            else:
+                step = 2 / (1+k)
+            next_y = y_k + step * direction
+            if keep_history:
+                y_list.append(next_y)
+            else:
+                y_list = [y_k, next_y]
+        with prof.phase('error'):
+            obj_list.append(game.get_potential(next_y))
+            if step_rule == 'exact':
+                err = -np.sum(grad_k * direction)
+            else:
+                err = np.sum(grad_k * (next_y - y_k))
+        if callback is not None and k % checkpoint_every == 0:
+            callback(k, next_y, obj_list[-1])
         k += 1
-        # compute error
-        err = 0
-        for g_t, y_1t, y_2t in zip(grad_list[-1], y_list[-1], y_list[-2]):
-            err += sum([g_t[sa] * (y_1t[sa] - y_2t[sa]) for sa in g_t.keys()])
         if verbose:
             print(f'\r FW: error is {err} in {k} steps   ', end='')
     # print('')
-    return y_list, obj_list
+    with prof.phase('conversion'):
+        y_dicts = [mdp.sa_dicts(y) for y in y_list]
+    return y_dicts, obj_list
+    
+
+def FW_active_set(game, max_error, max_iterations, initial_density=None, 
+                  verbose=True, variant='pairwise', active_set=None, 
+                  return_active_set=False, profiler=None):
+    """ Away-step or pairwise Frank-Wolfe for the queued game. 
+    
+    The iterate is kept as a convex combination of the deterministic policy
+    densities (vertices) returned by the dynamic programming oracle. Besides
+    moving toward the newest vertex, weight can be moved away from the 
+    active vertex with the worst gradient alignment, which removes the 
+    zig-zagging tail of the forward-only Frank-Wolfe. Steps use the exact
+    line search on the quadratic potential.
+    
+    Args:
+        game: a queue_game object.
+        max_error: stop when the Frank-Wolfe gap <grad, y_k - vertex> is 
+            below max_error.
+        max_iterations: maximum number of oracle calls.
+        initial_density: list of T density dicts or a (T, SA) array, used as
+            the first atom of the active set. Ignored if active_set is given.
+        variant: 'pairwise' or 'away'.
+        active_set: dict. {key: [vertex, weight]} an active set returned by a
+            previous call, used to warm start the iterate.
+        return_active_set: bool. True if the active set is also returned.
+        profiler: util.profiler.profiler. Times the phases of FW_dict, where
+            'convex combination' includes the choice of the away vertex, and
+            counts the 'oracle calls'.
+    Returns:
+        y_list: list holding the final iterate as a list of T density dicts.
+        obj_list: list of potential values, one per iterate.
+        active_set: dict. {key: [vertex, weight]}, vertex is a (T, SA) 
+            density and key is the policy bytes (None for the initial 
+            density). Only returned if return_active_set is True.
+    """
+    mdp = game.compiled
+    prof = pf.get(profiler)
+    with prof.phase('setup'):
+        if active_set is None:
+            if initial_density is None:
+                initial_density = game.get_density()
+            if not isinstance(initial_density, np.ndarray):
+                initial_density = mdp.sa_array(initial_density)
+            active_set = {None: [initial_density, 1.]}
+        else:
+            active_set = {key: [v, w] for key, (v, w) in active_set.items()}
+        y_k = sum(w * v for v, w in active_set.values())
+        obj_list = [game.get_potential(y_k)]
+    k = 1
+    err = max_error * 2
+    while k <= max_iterations and err > max_error:
+        with prof.phase('gradient'):
+            grad_k = game.get_gradient(y_k)
+        V_k, pol_k = dp.value_iteration_dict(grad_k, mdp, profiler=profiler)
+        key = pol_k.tobytes()
+        if key in active_set:
+            s_k = active_set[key][0]
+        else:
+            s_k, _ = dp.density_retrieval(pol_k, game, profiler=profiler)
+        prof.count('oracle calls')
+        with prof.phase('convex combination'):
+            # Frank-Wolfe gap and the away vertex with the worst alignment
+            err = -np.sum(grad_k * (s_k - y_k))
+            away_key = max(active_set, 
+                           key=lambda a: np.sum(grad_k * active_set[a][0]))
+            v_k, w_v = active_set[away_key]
+            if variant == 'pairwise':
+                direction = s_k - v_k
+                step = exact_step(grad_k, direction, game.R * direction, w_v)
+                active_set[away_key][1] -= step
+                if key not in active_set:
+                    active_set[key] = [s_k, 0.]
+                active_set[key][1] += step
+            elif err >= np.sum(grad_k * (v_k - y_k)) or w_v >= 1:
+                # forward step toward the new vertex
+                direction = s_k - y_k
+                step = exact_step(grad_k, direction, game.R * direction)
+                for atom in active_set.values():
+                    atom[1] *= (1 - step)
+                if key not in active_set:
+                    active_set[key] = [s_k, 0.]
+                active_set[key][1] += step
+            else:
+                # away step from the worst active vertex
+                direction = y_k - v_k
+                step = exact_step(grad_k, direction, game.R * direction, 
+                                  w_v / (1 - w_v))
+                for atom in active_set.values():
+                    atom[1] *= (1 + step)
+                active_set[away_key][1] -= step
+            active_set = {a: atom for a, atom in active_set.items() 
+                          if atom[1] > 1e-12}
+            y_k = y_k + step * direction
+        with prof.phase('error'):
+            obj_list.append(game.get_potential(y_k))
+        k += 1
+        if verbose:
+            print(f'\r FW {variant}: error is {err} in {k} steps, '
+                  f'{len(active_set)} active vertices   ', end='')
+    with prof.phase('conversion'):
+        y_dicts = [mdp.sa_dicts(y_k)]
+    if return_active_set:
+        return y_dicts, obj_list, active_set
+    return y_dicts, obj_list
+    
+
+def FW_batch(game, taus, max_error, max_iterations, initial_density=None,
+             verbose=True, step_rule='exact', profiler=None):
+    """ Solve the queued game for B toll vectors at once. 
+    
+    The iterates carry a leading batch axis through the gradient, the 
+    Bellman backup and the density retrieval, so the B equilibria are 
+    computed with the same sparse operations as a single one. Batch entries
+    whose error is below max_error stop moving.
+    
+    Args:
+        game: a queue_game object. Its own tolls are ignored.
+        taus: list of B toll dicts {(s, t): tau_st}.
+        max_error: stopping error of each batch entry, see FW_dict.
+        max_iterations: maximum number of iterations.
+        initial_density: list of T density dicts or a (T, SA) array, shared
+            by all batch entries.
+        step_rule: 'open_loop' or 'exact', see FW_dict.
+        profiler: util.profiler.profiler. Times the phases 'setup', 
+            'gradient', 'bellman backup', 'retrieval', 'convex combination'
+            and 'error', and counts the 'oracle calls', one per batched 
+            iteration.
+    Returns:
+        y: np array with shape (B, T, SA), the final iterates indexed by 
+            game.compiled.sa_index.
+        obj_list: list of np arrays with length B, the potential values of
+            each iterate.
+    """
+    mdp = game.compiled
+    prof = pf.get(profiler)
+    
+    def potential(y):
+        return np.sum(0.5 * game.R * y**2 + (game.C + tolls) * y, 
+                      axis=(1, 2))
+    with prof.phase('setup'):
+        if initial_density is None:
+            initial_density = game.get_density()
+        if not isinstance(initial_density, np.ndarray):
+            initial_density = mdp.sa_array(initial_density)
+        tolls = np.stack([game.toll_array(tau) for tau in taus])
+        B = len(taus)
+        s0 = mdp.s_vector(game.t0)
+        y_k = np.repeat(initial_density[np.newaxis], B, axis=0)
+        obj_list = [potential(y_k)]
+    k = 1
+    err = np.full(B, max_error * 2.)
+    while k <= max_iterations and np.any(np.abs(err) > max_error):
+        active = np.abs(err) > max_error
+        with prof.phase('gradient'):
+            grad_k = game.R * y_k + game.C + tolls
+        with prof.phase('bellman backup'):
+            V_k, pol_k = dp.value_iteration_array(grad_k, mdp)
+        with prof.phase('retrieval'):
+            sa_k, _ = dp.density_retrieval_array(pol_k, mdp, s0)
+        prof.count('oracle calls')
+        with prof.phase('convex combination'):
+            direction = sa_k - y_k
+            if step_rule == 'exact':
+                decrease = -np.sum(grad_k * direction, axis=(1, 2))
+                curvature = np.sum(game.R * direction**2, axis=(1, 2))
+                step = np.where(curvature > 0, 
+                                decrease / np.where(curvature > 0, 
+                                                    curvature, 1),
+                                1. * (decrease > 0))
+                step = np.clip(step, 0., 1.)
+                next_err = decrease
+            else:
+                step = np.full(B, 2 / (1+k))
+                next_err = -step * np.sum(grad_k * direction, axis=(1, 2))
+            step[~active] = 0
+            y_k = y_k + step[:, np.newaxis, np.newaxis] * direction
+        with prof.phase('error'):
+            err = np.where(active, next_err, err)
+            obj_list.append(potential(y_k))
+        k += 1
+        if verbose:
+            print(f'\r FW batch: max error is {np.max(np.abs(err))} in {k} '
+                  f'steps, {np.sum(active)} active   ', end='')
+    return y_k, obj_list
     
 
 def FW(x0, p0, P, gradF, 
@@ -67,7 +325,16 @@ def FW(x0, p0, P, gradF,
        maxError = 1e-1, 
        returnLastGrad = False, 
        maxIterations = 5000, 
-       returnHist = True):
+       returnHist = True,
+       step_rule = 'open_loop'):
+    """ Frank-Wolfe on (S, A, T) densities with dynamics P, either a dense
+    (T, S, S, A) array, a list of T sparse (S, S*A) matrices or a 
+    compiled_mdp, see dp.value_iteration.
+    
+    step_rule is 'open_loop' for the step 2/(1+k) or 'exact' for the exact 
+    line search of a quadratic potential, where the curvature along the 
+    step is measured as <gradF(xNext) - gradF(xk), xNext - xk>.
+    """
     it = 1
     err= 1e13
     states, actions, time = x0.shape
@@ -86,6 +353,9 @@ def FW(x0, p0, P, gradF,
         lastX =  1.0*xk;
         lastGrad = 1.0*gradient;
         V, xNext  = dp.value_iteration(gradient, p0, P,isMax);
+        if step_rule == 'exact':
+            step = exact_step(gradient, xNext - xk, 
+                              gradF(xNext) - gradient);
         xk = (1. - step)* xk + step*xNext;
         gradient = gradF(xk);
         
@@ -8,10 +8,18 @@ Dynamic programming methods:
 @author: Sarah Li
 """
 import numpy as np
+import algorithm.numba_backend as nb
+import models.compiled_mdp as c_mdp
+import util.profiler as pf
 
-def value_iteration_dict(cost, P, is_max=False):
+def value_iteration_dict(cost, P, is_max=False, backend='numpy', out=None,
+                         profiler=None):
     """ Value iteration with max/min objectives for a finite time horizon, 
-        total cost MDP whose transition and costs are dictionaries
+        total cost MDP whose transition and costs are dictionaries. 
+        
+        If cost is a (T, SA) array and P is a compiled_mdp, the vectorized
+        backward induction in value_iteration_array is used instead, or the
+        fused kernels of numba_backend if backend is 'numba'.
     
     Inputs:
         cost: list. [d_i] for i = 0...T-1
@@ -28,6 +36,11 @@ def value_iteration_dict(cost, P, is_max=False):
                             P_tsaj: float. probability of transitioning 
                                 into s_j from (t,s,a)
         is_max: bool. True if maximizing reward. False if minimizing cost.
+        backend: 'numpy' or 'numba'. 'numba' falls back to 'numpy' if numba
+            is not installed or cost has a batch dimension.
+        out: optional (V, pol) buffers for the numba backend.
+        profiler: util.profiler.profiler. Times the 'bellman backup' phase
+            and counts the states and state-actions backed up.
     Returns:
         V: list. [V_t] for t in 0 ... T-1.
             V_t: dict. {s: V_ts} for s in States. 
@@ -36,6 +49,21 @@ def value_iteration_dict(cost, P, is_max=False):
             pol_t: dict. {s: pol_ts} for s in States.
                 pol_ts: int in Actions. Optimal policy of state s at time t.   
     """
+    prof = pf.get(profiler)
+    if prof.enabled:
+        if isinstance(cost, np.ndarray):
+            prof.count('states backed up', cost.size // P.SA * P.S)
+            prof.count('state-actions backed up', cost.size)
+        else:
+            prof.count('states backed up', sum([len(P_t) for P_t in P]))
+            prof.count('state-actions backed up', 
+                       sum([len(P_ts) for P_t in P for P_ts in P_t.values()]))
+        with prof.phase('bellman backup'):
+            return value_iteration_dict(cost, P, is_max, backend, out)
+    if isinstance(cost, np.ndarray):
+        if cost.ndim == 2 and nb.use_numba(backend):
+            return nb.value_iteration(cost, P, is_max, *(out or ()))
+        return value_iteration_array(cost, P, is_max)
     T = len(P)
     V = []
     pol = []
@@ -62,7 +90,56 @@ def value_iteration_dict(cost, P, is_max=False):
     pol.reverse()
     return V, pol
  
-def density_retrieval(pol, game):
+def value_iteration_array(cost, mdp, is_max=False):
+    """ Backward induction for a finite time horizon, total cost MDP whose 
+        transitions are compiled into sparse kernels.
+        
+    Each time step performs one sparse mat-vec against V_{t+1} followed by a 
+    segmented min (max) over the contiguous actions of each state. Ties are
+    broken deterministically towards the first action in mdp.action_dict[s].
+    
+    Inputs:
+        cost: np array with shape (T, SA), indexed by mdp.sa_index, or with 
+            shape (B, T, SA) to solve B cost functions at once.
+        mdp: a compiled_mdp object.
+        is_max: bool. True if maximizing reward. False if minimizing cost.
+    Returns:
+        V: np array with shape (T, S), or (B, T, S). V[t, s] is the cost to
+            go of state s at time t.
+        pol: int np array with shape (T, S), or (B, T, S). pol[t, s] is the
+            index in mdp.sa_list of the optimal state-action of state s at 
+            time t.
+    """
+    batch_shape = cost.shape[:-2]
+    T = cost.shape[-2]
+    B = int(np.prod(batch_shape))
+    V = np.zeros(batch_shape + (T, mdp.S))
+    pol = np.zeros(batch_shape + (T, mdp.S), dtype=np.int64)
+    # the segments of all batch entries, laid end to end in one flat array
+    starts = (np.arange(B)[:, np.newaxis] * mdp.SA 
+              + mdp.state_offsets[:-1]).reshape(-1)
+    sa_state = (np.arange(B)[:, np.newaxis] * mdp.S 
+                + mdp.sa_state).reshape(-1)
+    sa_inds = np.tile(np.arange(mdp.SA), B)
+    for t in reversed(range(T)):
+        if t == T-1:
+            Q = cost[..., t, :].reshape(-1)
+        else:
+            Q = (cost[..., t, :] 
+                 + mdp.expectation(V[..., t+1, :], t)).reshape(-1)
+        if is_max:
+            Q = -Q
+        Q_min = np.minimum.reduceat(Q, starts)
+        # first state-action attaining the minimum in each state's segment
+        is_argmin = Q <= Q_min[sa_state]
+        pol[..., t, :] = np.minimum.reduceat(
+            np.where(is_argmin, sa_inds, mdp.SA), starts).reshape(
+                batch_shape + (mdp.S,))
+        V[..., t, :] = (-Q_min if is_max else Q_min).reshape(
+            batch_shape + (mdp.S,))
+    return V, pol
+ 
+def density_retrieval(pol, game, backend='numpy', out=None, profiler=None):
     """ Given initial state distribution and a finite horizion dynamics and
         policy, determine the corresponding station-action density.
     
@@ -72,11 +149,34 @@ def density_retrieval(pol, game):
                 a = optimal policy to take in state s at time i.
         game: a queued_game object.
         
+        If pol is a (T, S) int array of state-action indices, as returned by 
+        value_iteration_array, density_retrieval_array is used and the 
+        densities are returned as arrays. With backend 'numba' the fused 
+        kernels of numba_backend are used instead, writing into the optional
+        (sa_density, s_density) buffers out.
+        
+        profiler: util.profiler.profiler. Times the 'retrieval' phase and 
+            counts the states propagated.
+        
     Returns:
         sa_density: list. [d_i] for t= 0...T-1
             d_i: dict. {s: d_{0sa}} for s in States. 
             
     """
+    prof = pf.get(profiler)
+    if prof.enabled:
+        prof.count('states propagated', 
+                   pol.size if isinstance(pol, np.ndarray) 
+                   else sum([len(pol_t) for pol_t in pol]))
+        with prof.phase('retrieval'):
+            return density_retrieval(pol, game, backend, out)
+    if isinstance(pol, np.ndarray):
+        if pol.ndim == 2 and nb.use_numba(backend):
+            return nb.density_retrieval(pol, game.compiled, 
+                                        game.compiled.s_vector(game.t0),
+                                        *(out or ()))
+        return density_retrieval_array(pol, game.compiled, 
+                                       game.compiled.s_vector(game.t0))
     T = len(pol)
     sa_density = []
     s_density = [game.t0]
@@ -93,6 +193,55 @@ def density_retrieval(pol, game):
     
     return sa_density, s_density  
 
+def density_retrieval_array(pol, mdp, s0):
+    """ Forward pass of a deterministic policy through compiled dynamics.
+    
+    Inputs:
+        pol: int np array with shape (T, S), or (B, T, S) for B policies. 
+            pol[t, s] is the index in mdp.sa_list of the state-action taken
+            in state s at time t.
+        mdp: a compiled_mdp object.
+        s0: np array with length S, the initial state density.
+    Returns:
+        sa_density: np array with shape (T, SA), or (B, T, SA).
+        s_density: np array with shape (T+1, S), or (B, T+1, S).
+    """
+    batch_shape = pol.shape[:-2]
+    T = pol.shape[-2]
+    sa_density = np.zeros(batch_shape + (T, mdp.SA))
+    s_density = np.zeros(batch_shape + (T+1, mdp.S))
+    s_density[..., 0, :] = s0
+    for t in range(T):
+        np.put_along_axis(sa_density[..., t, :], pol[..., t, :], 
+                          s_density[..., t, :], axis=-1)
+        s_density[..., t+1, :] = mdp.propagate(sa_density[..., t, :], t)
+    return sa_density, s_density
+
+def kernel_expectation(P, V, t):
+    """ Return sum_s' P_t[s', sa] V[s'] for every state-action sa, with 
+    column s*A + a for the state-action (s, a).
+
+    P is either a dense (T, S, S, A) array, a list of T sparse (S, S*A)
+    matrices, or a compiled_mdp whose states all have the actions 0...A-1,
+    e.g. with the time invariant transitions in its shared kernel.
+    """
+    if isinstance(P, c_mdp.compiled_mdp):
+        return P.expectation(V, t)
+    if isinstance(P, np.ndarray):
+        return P[t].reshape(P.shape[1], -1).T @ V
+    return P[t].T @ V
+
+
+def kernel_propagate(P, x, t):
+    """ Return the state density at t+1 from the flat state-action density x
+    at t, with P as in kernel_expectation."""
+    if isinstance(P, c_mdp.compiled_mdp):
+        return P.propagate(x, t)
+    if isinstance(P, np.ndarray):
+        return P[t].reshape(P.shape[1], -1) @ x
+    return P[t] @ x
+
+
 def value_iteration(cost, p0, P, isMax = False):
     """ Value iteration with max/min objectives for a finite time horizon, total
     cost MDP.
@@ -100,56 +249,39 @@ def value_iteration(cost, p0, P, isMax = False):
     Inputs:
         cost: np array with shape (S, A, T).
         p0: initial probabilitiy distribution, np array with length S
-        P: transition kernel, np array with shape (S, S, A, T), P[s,r,a,t] is
+        P: transition kernel, np array with shape (T, S, S, A), P[t,s,r,a] is
           the probability of transition from state r to state s by taking 
-          action a at time t. 
+          action a at time t. P may also be a list of T sparse matrices with
+          shape (S, S*A), or a compiled_mdp, see kernel_expectation. 
     Returns:
-        V: values of each state, np array with length S.
+        V: values of each state, np array with shape (S, T).
         x_next: the optimal population distribution, np array with shape 
         (S,A,T).
     """
-    S, A, T = cost.shape;
-    V = np.zeros((S, T));
-    policy = np.zeros((S, T)); # pi_t(state) = action;
-    trajectory = np.zeros((S,T));
-    xNext = np.zeros((S,A,T));
+    S, A, T = cost.shape
+    V = np.zeros((S, T))
+    policy = np.zeros((S, T), dtype=int) # pi_t(state) = action
+    xNext = np.zeros((S, A, T))
 
     # construct optimal value function and policy
     for tIter in range(T):
         t = T-1-tIter # true time since we are backward propagating.
-        cCurrent =cost[:,:,t]; 
-        if t == T-1:       
-            if isMax:
-                V[:,t] = np.max(cCurrent, axis = 1);
-                policy[:,t] = np.argmax(cCurrent, axis=1);
-            else:                 
-                V[:,t] = np.min(cCurrent, axis = 1);
-                policy[:,t] = np.argmin(cCurrent, axis=1);
-        else:
+        obj = 1.0 * cost[:, :, t]
+        if t < T-1:
             # solve the Bellman operator
-            Vt = V[:,t+1];
-            obj = cCurrent + np.einsum('ijk,i',P[t,:,:,:],Vt);
-            if isMax:
-                V[:,t] = np.max(obj, axis=1);
-                policy[:,t] = np.argmax(obj, axis=1);
-            else:
-                V[:,t] = np.min(obj, axis=1);
-                policy[:,t] = np.argmin(obj, axis=1);
+            obj += kernel_expectation(P, V[:, t+1], t).reshape(S, A)
+        if isMax:
+            policy[:, t] = np.argmax(obj, axis=1)
+        else:
+            policy[:, t] = np.argmin(obj, axis=1)
+        V[:, t] = obj[np.arange(S), policy[:, t]]
 
     # construct the optimal trajectory corresponding to the Bellman operator.
+    traj = 1.0 * p0
     for t in range(T):
-        if t == 0:
-            traj = 1.0*p0;
-        else:
-            traj = trajectory[:,t-1];
-        # construct y
-        pol = policy[:,t];
-        x = np.zeros((S,A));
-
-        for s in range(S):
-            x[s,int(pol[s])] = 1* traj[s];
-        xNext[:,:,t] = 1.0*x;
-        trajectory[:,t] =  np.einsum('ijk,jk',P[t,:,:,:],x);
-
-    return V, xNext; 
+        xNext[np.arange(S), policy[:, t], t] = traj
+        if t < T-1:
+            x = xNext[:, :, t].ravel()
+            traj = kernel_propagate(P, x, t)
 
+    return V, xNext
@@ -8,9 +8,11 @@ Implementation of inexact projected gradient ascent.
 """
 from datetime import datetime
 import numpy as np
+import algorithm.FW as fw
+import util.profiler as pf
 
 def inexact_pga(game, tau_0, approx_gradient, step_size, max_iteration = 1000,
-                epsilons = None, verbose = False):
+                epsilons = None, verbose = False, profiler = None):
     """ Perform inexact gradient ascent where projection into the positive
     quadrant is performed. 
     
@@ -21,10 +23,15 @@ def inexact_pga(game, tau_0, approx_gradient, step_size, max_iteration = 1000,
         step_size: gradient descent step size
         max_iteration: maximum number of iterations for the algorithm
         epsilons: the accuracy achieved during each iteration
+        profiler: util.profiler.profiler, times the phases 'gradient oracle'
+          (the call to approx_gradient) and 'outer bookkeeping', and counts
+          the 'outer iterations'. Pass the same profiler to the solver in 
+          approx_gradient to time its phases within the oracle.
     Returns:
         tau_hist: tau value each iteration
         gradient_hist: the gradient value each iteration
     """
+    prof = pf.get(profiler)
     if epsilons is None:
         # use the harmonic series as epsilons by default. 
         print('using harmonic series as epsilon in inexact projected gradient descent.')
@@ -44,20 +51,88 @@ def inexact_pga(game, tau_0, approx_gradient, step_size, max_iteration = 1000,
                 tau_values = np.array(list(tau_hist[-1].values()))  
             print(np.linalg.norm(tau_values, 1))
             
-        gradient = approx_gradient(game, tau_hist[-1], epsilons[t], t)
-        gradient_hist.append(gradient)
-        tau_hist.append({})
-        if is_dict: 
-            tau_hist[-1] = {zt: max([0, tau_hist[-2][zt]+step_size*gradient[zt]])
-                        for zt in tau_hist[-2].keys() }
-        else:
-            tau_hist[-1] = tau_hist[-2] + step_size * gradient
-            tau_hist[-1][tau_hist[-1] < 0] = 0
+        with prof.phase('gradient oracle'):
+            gradient = approx_gradient(game, tau_hist[-1], epsilons[t], t)
+        prof.count('outer iterations')
+        with prof.phase('outer bookkeeping'):
+            gradient_hist.append(gradient)
+            tau_hist.append({})
+            if is_dict: 
+                tau_hist[-1] = {
+                    zt: max([0, tau_hist[-2][zt]+step_size*gradient[zt]])
+                    for zt in tau_hist[-2].keys() }
+            else:
+                tau_hist[-1] = tau_hist[-2] + step_size * gradient
+                tau_hist[-1][tau_hist[-1] < 0] = 0
             
         # tau_hist.append(tau_next)
 
     return tau_hist, gradient_hist
 
+class warm_start_solver:
+    
+    def __init__(self, game, max_iterations, initial_density=None, 
+                 warm_start=True, active_set=False, **fw_args):
+        """ Equilibrium solver for the inner problem of the dual ascent. 
+        
+        Consecutive tolls of inexact_pga differ only slightly, so each 
+        Frank-Wolfe solve starts from the final iterate (and, with 
+        active_set, the active vertex set) of the previous solve.
+        
+        Args:
+            game: a queue_game object.
+            max_iterations: maximum number of Frank-Wolfe iterations per 
+                solve.
+            initial_density: density of the first solve. A random density 
+                from game.get_density() is used if None.
+            warm_start: bool. If False, every solve starts from 
+                initial_density.
+            active_set: bool. True to solve with fw.FW_active_set and carry
+                its active set between solves, False to use fw.FW_dict.
+            fw_args: additional keyword arguments of the Frank-Wolfe solver.
+                When warm starting fw.FW_dict, step_rule defaults to 'exact'
+                since the open loop step 2/(1+k) jumps to the first vertex 
+                and discards the warm start.
+        """
+        self.game = game
+        self.max_iterations = max_iterations
+        self.warm_start = warm_start
+        self.use_active_set = active_set
+        self.fw_args = fw_args
+        if warm_start and not active_set:
+            self.fw_args.setdefault('step_rule', 'exact')
+        if initial_density is None:
+            initial_density = game.get_density()
+        if not isinstance(initial_density, np.ndarray):
+            initial_density = game.compiled.sa_array(initial_density)
+        self.initial_density = initial_density
+        self.density = initial_density
+        self.active_set = None
+        self.oracle_calls = 0
+    
+    def solve(self, tau, max_error):
+        """ Solve the game tolled by tau to accuracy max_error.
+        
+        Returns:
+            y_list, obj_list: as returned by the Frank-Wolfe solver.
+        """
+        self.game.update_tolls(tau)
+        if self.use_active_set:
+            y_list, obj_list, active_set = fw.FW_active_set(
+                self.game, max_error, self.max_iterations, self.density,
+                active_set=self.active_set, return_active_set=True, 
+                **self.fw_args)
+            if self.warm_start:
+                self.active_set = active_set
+        else:
+            y_list, obj_list = fw.FW_dict(
+                self.game, max_error, self.max_iterations, self.density,
+                **self.fw_args)
+            if self.warm_start:
+                self.density = self.game.compiled.sa_array(y_list[-1])
+        self.oracle_calls += len(obj_list) - 1
+        return y_list, obj_list
+    
 def fast_inexact_pga(tau_0, approx_gradient, step_size, max_iteration = 1000,
                 epsilons = None, verbose = False, lipschitz = 1):
     """ Perform inexact gradient ascent where projection into the positive
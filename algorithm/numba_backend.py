@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 14:20:31 2026
+
+Optional numba kernels for the compiled queued game: a fused Bellman backup
+and argmin per time step, and a fused density scatter and propagation. They
+loop over the CSR arrays of compiled_mdp.P_T (and shared_T) in nopython mode
+and write into preallocated buffers, so no temporaries are created per step.
+
+When numba is not installed the kernels are left as plain python and
+backend 'numba' falls back to the numpy methods of dynamic_programming.
+
+@author: Sarah Li
+"""
+import warnings
+import numpy as np
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def available():
+    """ Return True if numba is installed."""
+    return numba is not None
+
+
+def use_numba(backend):
+    """ Return True if the numba kernels should be used for backend, which is
+    'numpy' or 'numba'. Warns if 'numba' is requested but not installed."""
+    if backend not in ('numpy', 'numba'):
+        raise ValueError(f'unknown backend {backend}, use numpy or numba.')
+    if backend == 'numba' and not available():
+        warnings.warn('numba is not installed, using the numpy backend.')
+        return False
+    return backend == 'numba'
+
+
+def _bellman_backup(cost_t, V_next, has_next, is_max, state_offsets,
+                    indptr, indices, data,
+                    shared_indptr, shared_indices, shared_data,
+                    V_out, pol_out):
+    """ Write the optimal value V_out[s] and state-action pol_out[s] of each
+    state at one time step. Q[sa] = cost_t[sa] + sum_s' P_T[sa, s'] V_next[s']
+    is computed one state-action at a time and never stored. Ties go to the
+    first action of the state."""
+    S = state_offsets.shape[0] - 1
+    sign = -1. if is_max else 1.
+    for s in range(S):
+        best = np.inf
+        best_sa = state_offsets[s]
+        for sa in range(state_offsets[s], state_offsets[s+1]):
+            Q = cost_t[sa]
+            if has_next:
+                # summed in the order of compiled_mdp.expectation
+                expected_V = 0.
+                for k in range(indptr[sa], indptr[sa+1]):
+                    expected_V += data[k] * V_next[indices[k]]
+                shared_V = 0.
+                for k in range(shared_indptr[sa], shared_indptr[sa+1]):
+                    shared_V += shared_data[k] * V_next[shared_indices[k]]
+                Q += expected_V + shared_V
+            if sign * Q < best:
+                best = sign * Q
+                best_sa = sa
+        V_out[s] = sign * best
+        pol_out[s] = best_sa
+
+
+def _scatter_propagate(s_density_t, pol_t, indptr, indices, data,
+                       shared_indptr, shared_indices, shared_data,
+                       sa_out, s_next_out):
+    """ Put the density of each state on its state-action pol_t[s] in sa_out,
+    and push it through the rows of P_T into s_next_out. Only the chosen
+    state-actions are visited."""
+    sa_out[:] = 0.
+    s_next_out[:] = 0.
+    for s in range(pol_t.shape[0]):
+        sa = pol_t[s]
+        mass = s_density_t[s]
+        sa_out[sa] = mass
+        for k in range(indptr[sa], indptr[sa+1]):
+            s_next_out[indices[k]] += data[k] * mass
+        for k in range(shared_indptr[sa], shared_indptr[sa+1]):
+            s_next_out[shared_indices[k]] += shared_data[k] * mass
+
+
+if numba is not None:
+    _bellman_backup = numba.njit(cache=True, nogil=True)(_bellman_backup)
+    _scatter_propagate = numba.njit(cache=True, nogil=True)(_scatter_propagate)
+
+
+def _shared_arrays(mdp):
+    """ CSR arrays of mdp.shared_T, or of an empty (SA, S) matrix."""
+    if mdp.shared_T is None:
+        return (np.zeros(mdp.SA + 1, dtype=np.int32),
+                np.zeros(0, dtype=np.int32), np.zeros(0))
+    return mdp.shared_T.indptr, mdp.shared_T.indices, mdp.shared_T.data
+
+
+def value_iteration(cost, mdp, is_max=False, V=None, pol=None):
+    """ Backward induction with the fused numba Bellman backup, see
+    dynamic_programming.value_iteration_array.
+
+    Inputs:
+        cost: np array with shape (T, SA), indexed by mdp.sa_index.
+        mdp: a compiled_mdp object.
+        is_max: bool. True if maximizing reward. False if minimizing cost.
+        V, pol: optional (T, S) float and int buffers to write the result in.
+    Returns:
+        V: np array with shape (T, S), the cost to go.
+        pol: int np array with shape (T, S), the optimal state-action
+            indices.
+    """
+    T = cost.shape[0]
+    if V is None:
+        V = np.zeros((T, mdp.S))
+    if pol is None:
+        pol = np.zeros((T, mdp.S), dtype=np.int64)
+    shared_indptr, shared_indices, shared_data = _shared_arrays(mdp)
+    for t in reversed(range(T)):
+        P_T = mdp.P_T[t]
+        V_next = V[t+1] if t < T-1 else V[t]
+        _bellman_backup(cost[t], V_next, t < T-1, is_max, mdp.state_offsets,
+                        P_T.indptr, P_T.indices, P_T.data,
+                        shared_indptr, shared_indices, shared_data,
+                        V[t], pol[t])
+    return V, pol
+
+
+def density_retrieval(pol, mdp, s0, sa_density=None, s_density=None):
+    """ Forward pass of a deterministic policy with the fused numba scatter
+    and propagation, see dynamic_programming.density_retrieval_array.
+
+    Inputs:
+        pol: int np array with shape (T, S) of state-action indices.
+        mdp: a compiled_mdp object.
+        s0: np array with length S, the initial state density.
+        sa_density, s_density: optional (T, SA) and (T+1, S) buffers to
+            write the result in.
+    Returns:
+        sa_density: np array with shape (T, SA).
+        s_density: np array with shape (T+1, S).
+    """
+    T = pol.shape[0]
+    if sa_density is None:
+        sa_density = np.zeros((T, mdp.SA))
+    if s_density is None:
+        s_density = np.zeros((T+1, mdp.S))
+    s_density[0] = s0
+    shared_indptr, shared_indices, shared_data = _shared_arrays(mdp)
+    for t in range(T):
+        P_T = mdp.P_T[t]
+        _scatter_propagate(s_density[t], pol[t],
+                           P_T.indptr, P_T.indices, P_T.data,
+                           shared_indptr, shared_indices, shared_data,
+                           sa_density[t], s_density[t+1])
+    return sa_density, s_density
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 15:02:11 2026
+
+Benchmarks of the solver hot paths: propagate, value_iteration_dict,
+density_retrieval, one FW_dict iteration, a full FW_dict solve and one outer
+iteration of inexact_pga. Each path is timed on a ladder of game sizes, from
+the two-zone models/test_model.queue_game to Manhattan sized and citywide
+games from models/synthetic_model, so no TLC data is needed.
+
+Run from the repository root:
+    python -m benchmarks.bench_solvers --save      # record the baseline
+    python -m benchmarks.bench_solvers             # compare to the baseline
+    python -m benchmarks.bench_solvers --check     # fail without a baseline
+The run exits with status 1 if a path is slower than time_threshold times,
+or uses more than memory_threshold times the peak memory of, the baseline.
+The baseline is machine specific and not committed, so a plain run without
+one only reports the timings, while --check fails, e.g. in CI.
+
+@author: Sarah Li
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+import numpy as np
+import scipy
+import algorithm.dynamic_programming as dp
+import algorithm.FW as fw
+import algorithm.inexact_projected_gradient_ascent as pga
+import models.synthetic_model as synthetic
+import models.test_model as test_model
+import models.taxi_dynamics.manhattan_neighbors as manhattan
+
+baseline_file = os.path.join(os.path.dirname(__file__), 'baseline.json')
+fw_solve_iterations = 50 # Frank-Wolfe iterations of the full solve
+pga_fw_iterations = 20 # Frank-Wolfe iterations per inexact_pga iteration
+run_all = -1 # a max_error that runs every Frank-Wolfe iteration
+
+
+def toy_game():
+    return test_model.queue_game(total_mass=10)
+
+
+def manhattan_game():
+    return synthetic.synthetic_game(zones=len(manhattan.zone_neighbors))
+
+
+def citywide_game():
+    return synthetic.synthetic_game(zones=260)
+
+
+scales = {'toy': toy_game,
+          'manhattan': manhattan_game,
+          'citywide': citywide_game}
+
+
+def benchmarks(game):
+    """ Return {name: function} of the benchmarked paths on game. Every
+    function runs one call of the path from the same fixed inputs."""
+    mdp = game.compiled
+    np.random.seed(0)
+    y = mdp.sa_array(game.get_density())
+    grad = game.get_gradient(y)
+    _, pol = dp.value_iteration_dict(grad, mdp)
+    state_zones = sorted(set([s[0] for s in mdp.state_list]))
+    constrained_zones = state_zones[:3]
+    constrained_value = 0.5 * game.mass / len(state_zones)
+    tau = {((z, 0), t): 0. for z in constrained_zones for t in range(mdp.T)}
+
+    def propagate():
+        for t in range(mdp.T):
+            mdp.propagate(y[t], t)
+
+    def value_iteration():
+        dp.value_iteration_dict(grad, mdp)
+
+    def density_retrieval():
+        dp.density_retrieval(pol, game)
+
+    def fw_iteration():
+        fw.FW_dict(game, run_all, 1, y, verbose=False, keep_history=False)
+
+    def fw_solve():
+        fw.FW_dict(game, run_all, fw_solve_iterations, y, verbose=False,
+                   keep_history=False)
+
+    def pga_iteration():
+        game.set_constraints(constrained_zones, constrained_value)
+        solver = pga.warm_start_solver(game, pga_fw_iterations, y,
+                                       verbose=False, keep_history=False)
+        def approx_gradient(game, cur_tau, approx_err, k):
+            y_list, _ = solver.solve(cur_tau, approx_err)
+            return game.get_constrained_gradient(y_list[-1])
+        pga.inexact_pga(game, tau, approx_gradient, 1., 1, epsilons=[run_all])
+        game.tolls = None
+
+    return {'propagate': propagate,
+            'value_iteration_dict': value_iteration,
+            'density_retrieval': density_retrieval,
+            'fw_iteration': fw_iteration,
+            'fw_solve': fw_solve,
+            'pga_iteration': pga_iteration}
+
+
+def measure(func, repeat=5):
+    """ Time func with timeit and measure its peak memory with tracemalloc.
+
+    Returns:
+        result: dict. 'time' is the fastest time per call in seconds over
+            the repeats, 'median_time' the median, and 'peak_bytes' the peak
+            memory allocated by one call.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    times = np.array(timer.repeat(repeat, number)) / number
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'time': float(times.min()), 'median_time': float(np.median(times)),
+            'peak_bytes': int(peak)}
+
+
+def run(scale_names, repeat=5, verbose=True):
+    """ Run the benchmarks of each scale in scale_names.
+
+    Returns:
+        results: dict. {scale: {'S':, 'SA':, 'T':, 'build_time':,
+            'benchmarks': {name: measure(...)}}}.
+    """
+    results = {}
+    for scale in scale_names:
+        start = time.perf_counter()
+        game = scales[scale]()
+        build_time = time.perf_counter() - start
+        mdp = game.compiled
+        results[scale] = {'S': mdp.S, 'SA': mdp.SA, 'T': mdp.T,
+                          'build_time': build_time, 'benchmarks': {}}
+        if verbose:
+            print(f'{scale}: S = {mdp.S}, SA = {mdp.SA}, T = {mdp.T}, built '
+                  f'in {build_time:.2f} s')
+        for name, func in benchmarks(game).items():
+            result = measure(func, repeat)
+            results[scale]['benchmarks'][name] = result
+            if verbose:
+                print(f'    {name:<22}{result["time"]*1e3:>12.3f} ms'
+                      f'{result["peak_bytes"]/2**20:>12.2f} MB')
+    return results
+
+
+def environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__,
+            'scipy': scipy.__version__, 'machine': platform.machine(),
+            'processor': platform.processor(),
+            'date': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+
+def save_baseline(results, filename=baseline_file):
+    with open(filename, 'w') as baseline:
+        json.dump({'environment': environment(), 'results': results},
+                  baseline, indent=2)
+
+
+def load_baseline(filename=baseline_file):
+    with open(filename) as baseline:
+        return json.load(baseline)['results']
+
+
+def regressions(results, baseline, time_threshold=1.5, memory_threshold=1.2):
+    """ Compare results to baseline.
+
+    Returns:
+        regressed: list of strings, one per benchmark that is slower than
+            time_threshold times, or takes more than memory_threshold times
+            the peak memory of, its baseline. Benchmarks missing from the
+            baseline are skipped.
+    """
+    regressed = []
+    for scale, result in results.items():
+        for name, current in result['benchmarks'].items():
+            if name not in baseline.get(scale, {}).get('benchmarks', {}):
+                continue
+            base = baseline[scale]['benchmarks'][name]
+            time_ratio = current['time'] / base['time']
+            memory_ratio = current['peak_bytes'] / max(base['peak_bytes'], 1)
+            if time_ratio > time_threshold:
+                regressed.append(f'{scale}/{name}: time {time_ratio:.2f}x '
+                                 'baseline')
+            if memory_ratio > memory_threshold:
+                regressed.append(f'{scale}/{name}: peak memory '
+                                 f'{memory_ratio:.2f}x baseline')
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--scales', nargs='+', default=list(scales.keys()),
+                        choices=list(scales.keys()))
+    parser.add_argument('--baseline', default=baseline_file)
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--save', action='store_true',
+                      help='save the results as the new baseline')
+    mode.add_argument('--check', action='store_true',
+                      help='exit with status 1 if there is no baseline')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--time-threshold', type=float, default=1.5)
+    parser.add_argument('--memory-threshold', type=float, default=1.2)
+    args = parser.parse_args(argv)
+
+    if args.check and not os.path.exists(args.baseline):
+        print(f'no baseline at {args.baseline}, run with --save first.')
+        return 1
+    results = run(args.scales, args.repeat)
+    if args.save:
+        save_baseline(results, args.baseline)
+        print(f'saved baseline to {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f'no baseline at {args.baseline}, run with --save first.')
+        return 0
+    regressed = regressions(results, load_baseline(args.baseline),
+                            args.time_threshold, args.memory_threshold)
+    for regression in regressed:
+        print(f'REGRESSION {regression}')
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
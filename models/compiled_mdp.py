@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 08:30:12 2026
+
+Compiled representation of a finite horizon MDP whose dynamics are given as
+transition dictionaries (see manhattan_transition.transition_kernel_dict).
+
+Every state and every state-action pair is given a dense integer index.
+State-actions are ordered state by state, following the order of the state
+list and of each state's action list, so that the actions of a state occupy
+a contiguous segment [state_offsets[s], state_offsets[s+1]).
+
+The transition kernel of time step t is stored as a scipy.sparse matrix P[t]
+with shape (S, SA), where P[t][j, i] is the probability of transitioning
+into state j when taking state-action i at time t. Propagating a state-action
+density through the dynamics is then a single sparse mat-vec.
+
+The transposed kernel P_T[t] is a CSR matrix that keeps, in each row, the 
+destinations of the state-action in the order they were given (see 
+forward_kernel), so that the transition dictionaries rebuilt by forward_dicts
+list them in their original order, e.g. the targeted neighbor first. P[t] is
+the CSC view of the same arrays, so a memory-mapped P_T[t] is never copied.
+
+For long horizons, the state-actions whose transitions do not depend on t 
+(going to neighbors, dropping queue levels) can be stored once in a shared 
+kernel, and P[t] then only holds the time varying state-actions (picking up
+riders). The full kernel of time t is shared + P[t], see kernel(t).
+
+@author: Sarah Li
+"""
+import os
+import struct
+import zipfile
+import numpy as np
+import scipy.sparse as sparse
+
+
+class compiled_mdp:
+
+    def __init__(self, state_list, action_dict, kernels, shared=None):
+        """ Index the states and state-actions of an MDP and store its
+        per time step transition kernels.
+
+        Args:
+            state_list: list of states, each state is (zone_ind, queue_level).
+            action_dict: dict. {s: [a_k]} list of actions available in s.
+            kernels: list of T sparse matrices with shape (S, SA). The
+                destinations of a state-action keep their order if the 
+                kernel is a CSC matrix, see forward_kernel, and are ordered 
+                by state index otherwise.
+            shared: sparse matrix with shape (S, SA), the time invariant part
+                of the kernels. If given, kernels only hold the time varying 
+                part, and the two must not share state-actions.
+        """
+        self.state_list = list(state_list)
+        self.action_dict = action_dict
+        self.state_index = {s: i for i, s in enumerate(self.state_list)}
+
+        self.sa_list = [(s, a) for s in self.state_list
+                        for a in action_dict[s]]
+        self.sa_index = {sa: i for i, sa in enumerate(self.sa_list)}
+        self.S = len(self.state_list)
+        self.SA = len(self.sa_list)
+
+        actions_per_state = np.array(
+            [len(action_dict[s]) for s in self.state_list], dtype=np.int64)
+        self.state_offsets = np.zeros(self.S + 1, dtype=np.int64)
+        self.state_offsets[1:] = np.cumsum(actions_per_state)
+        self.sa_state = np.repeat(np.arange(self.S), actions_per_state)
+        self.sa_action = np.array([sa[1] for sa in self.sa_list],
+                                  dtype=np.int64)
+
+        # transposed kernels, used for the expected cost-to-go in the
+        # Bellman backup. The transpose of a CSC kernel is a CSR matrix with
+        # the same arrays, so the order of the destinations is kept, and the
+        # kernels P are CSC views of the arrays of P_T.
+        self.P_T = [sparse.csc_matrix(P_t).T for P_t in kernels]
+        self.P = [P_T_t.T for P_T_t in self.P_T]
+        self.T = len(self.P)
+        self.shared = None
+        self.shared_T = None
+        if shared is not None:
+            self.shared_T = sparse.csc_matrix(shared).T
+            self.shared = self.shared_T.T
+
+    def kernel(self, t):
+        """ Return the full transition kernel of time t."""
+        if self.shared is None:
+            return self.P[t]
+        return self.shared + self.P[t]
+
+    def propagate(self, sa_density, t):
+        """ Return the state density at t+1 from the state-action density
+        at t, both as arrays. A (B, SA) sa_density propagates B densities."""
+        x = sa_density.T if sa_density.ndim == 2 else sa_density
+        next_density = self.P[t] @ x
+        if self.shared is not None:
+            next_density += self.shared @ x
+        return next_density.T if sa_density.ndim == 2 else next_density
+
+    def expectation(self, V, t):
+        """ Return E[V(s') | s, a] at time t for every state-action. A (B, S)
+        V returns a (B, SA) array."""
+        x = V.T if V.ndim == 2 else V
+        expected_V = self.P_T[t] @ x
+        if self.shared is not None:
+            expected_V += self.shared_T @ x
+        return expected_V.T if V.ndim == 2 else expected_V
+
+    def forward_T(self, t):
+        """ Return the transpose of kernel(t), a CSR matrix with shape 
+        (SA, S) whose rows keep the order of the destinations."""
+        if self.shared is None:
+            return self.P_T[t]
+        # the shared and time varying rows are disjoint: interleave them
+        shared_T, P_T_t = self.shared_T, self.P_T[t]
+        shared_lengths = np.diff(shared_T.indptr)
+        lengths = np.diff(P_T_t.indptr)
+        indptr = np.zeros(self.SA + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(shared_lengths + lengths)
+        shared_pos = (np.repeat(indptr[:-1] - shared_T.indptr[:-1], 
+                                shared_lengths) + np.arange(shared_T.nnz))
+        pos = (np.repeat(indptr[:-1] + shared_lengths - P_T_t.indptr[:-1],
+                         lengths) + np.arange(P_T_t.nnz))
+        data = np.zeros(indptr[-1])
+        indices = np.zeros(indptr[-1], dtype=np.int64)
+        data[shared_pos], indices[shared_pos] = shared_T.data, shared_T.indices
+        data[pos], indices[pos] = P_T_t.data, P_T_t.indices
+        return sparse.csr_matrix((data, indices, indptr), 
+                                 shape=(self.SA, self.S))
+
+    def split_shared(self):
+        """ Return a copy of the MDP whose state-actions with the same 
+        transitions at every time step are stored once in a shared kernel.
+        """
+        kernels = [self.kernel(t) for t in range(self.T)]
+        is_shared = np.ones(self.SA, dtype=bool)
+        for P_t in kernels[1:]:
+            is_shared &= (P_t != kernels[0]).getnnz(axis=0) == 0
+        shared = _select_rows(self.forward_T(0), is_shared).T
+        deltas = [_select_rows(self.forward_T(t), ~is_shared).T 
+                  for t in range(self.T)]
+        return compiled_mdp(self.state_list, self.action_dict, deltas, 
+                            shared)
+
+    def kernel_nbytes(self):
+        """ Return the memory used by the kernels, which share their arrays
+        with their transposes."""
+        kernels = self.P_T
+        if self.shared is not None:
+            kernels = kernels + [self.shared_T]
+        return sum([P_t.data.nbytes + P_t.indices.nbytes + P_t.indptr.nbytes
+                    for P_t in kernels])
+
+    def sa_vector(self, d_t):
+        """ Convert {(s,a): d_sa} to an array of length SA."""
+        return np.fromiter((d_t[sa] for sa in self.sa_list), dtype=float,
+                           count=self.SA)
+
+    def sa_array(self, density):
+        """ Convert a list of T {(s,a): d_tsa} dicts to a (T, SA) array."""
+        return np.array([self.sa_vector(d_t) for d_t in density])
+
+    def sa_dict(self, sa_density):
+        """ Convert an array of length SA to {(s,a): d_sa}."""
+        return dict(zip(self.sa_list, sa_density.tolist()))
+
+    def sa_dicts(self, density):
+        """ Convert a (T, SA) array to a list of T {(s,a): d_tsa} dicts."""
+        return [self.sa_dict(d_t) for d_t in density]
+
+    def s_vector(self, s_density):
+        """ Convert {s: d_s} to an array of length S."""
+        return np.fromiter((s_density[s] for s in self.state_list),
+                           dtype=float, count=self.S)
+
+    def s_dict(self, s_density):
+        """ Convert an array of length S to {s: d_s}."""
+        return dict(zip(self.state_list, s_density.tolist()))
+
+    def cost_arrays(self, costs):
+        """ Convert a list of T {(s,a): (R_tsa, C_tsa)} dicts to the (T, SA)
+        arrays R and C."""
+        R = np.array([[c_t[sa][0] for sa in self.sa_list] for c_t in costs],
+                     dtype=float)
+        C = np.array([[c_t[sa][1] for sa in self.sa_list] for c_t in costs],
+                     dtype=float)
+        return R, C
+
+    def toll_arrays(self, tolls, actions=None):
+        """ Convert state tolls to a sparse index/value pair over the
+        flattened (T, SA) state-action array.
+
+        Args:
+            tolls: dict. {(s, t): tau_st} toll on state s at time t.
+            actions: list of actions that are tolled in each state. If None,
+                every action of the state is tolled.
+        Returns:
+            toll_index: int array, indices into the flattened (T, SA) array.
+            toll_value: float array, the toll on each of these indices.
+        """
+        toll_index, toll_value = [], []
+        for (s, t), tau_st in tolls.items():
+            for a in self.action_dict[s]:
+                if actions is None or a in actions:
+                    toll_index.append(t * self.SA + self.sa_index[(s, a)])
+                    toll_value.append(tau_st)
+        return (np.array(toll_index, dtype=np.int64),
+                np.array(toll_value, dtype=float))
+
+    def forward_dicts(self):
+        """ Rebuild the forward transition dictionaries, see 
+        manhattan_transition.transition_kernel_dict."""
+        forward_P = []
+        for t in range(self.T):
+            P_T_t = self.forward_T(t)
+            forward_P.append({s: {} for s in self.state_list})
+            for i, (s, a) in enumerate(self.sa_list):
+                row = slice(P_T_t.indptr[i], P_T_t.indptr[i+1])
+                forward_P[-1][s][a] = (
+                    [self.state_list[j] for j in P_T_t.indices[row]], 
+                    P_T_t.data[row].tolist())
+        return forward_P
+
+    def backward_dicts(self):
+        """ Rebuild the backward transition dictionaries, see 
+        manhattan_transition.transition_kernel_dict."""
+        backward_P = []
+        for t in range(self.T):
+            P_t = self.kernel(t).tocsr()
+            backward_P.append({})
+            for j, s in enumerate(self.state_list):
+                row = slice(P_t.indptr[j], P_t.indptr[j+1])
+                backward_P[-1][s] = (
+                    [self.sa_list[i] for i in P_t.indices[row]], 
+                    P_t.data[row].tolist())
+        return backward_P
+
+    def cost_dicts(self, R, C):
+        """ Convert (T, SA) cost arrays to a list of T 
+        {(s,a): (R_tsa, C_tsa)} dicts."""
+        return [dict(zip(self.sa_list, zip(R_t.tolist(), C_t.tolist()))) 
+                for R_t, C_t in zip(R, C)]
+
+    def policy_dicts(self, pol):
+        """ Convert a (T, S) array of chosen state-action indices to a list
+        of T {s: a} dicts."""
+        return [dict(zip(self.state_list, self.sa_action[pol_t].tolist()))
+                for pol_t in pol]
+
+    def policy_array(self, pol):
+        """ Convert a list of T {s: a} dicts to a (T, S) array of chosen
+        state-action indices."""
+        return np.array([[self.sa_index[(s, pol_t[s])]
+                          for s in self.state_list] for pol_t in pol],
+                        dtype=np.int64)
+
+
+def _select_rows(M, keep):
+    """ Return the CSR matrix M with the rows where keep is False emptied,
+    without reordering the entries of the other rows."""
+    lengths = np.diff(M.indptr)
+    mask = np.repeat(keep, lengths)
+    indptr = np.zeros(M.shape[0] + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(lengths * keep)
+    return sparse.csr_matrix((M.data[mask], M.indices[mask], indptr), 
+                             shape=M.shape)
+
+
+def forward_kernel(rows, cols, probs, shape):
+    """ Build a kernel from (dest_state, origin_sa, probability) triplets as
+    a CSC matrix, keeping the destinations of each state-action in the order
+    of the triplets. Repeated destinations are kept as separate entries.
+    """
+    cols = np.asarray(cols, dtype=np.int64)
+    order = np.argsort(cols, kind='stable')
+    indptr = np.zeros(shape[1] + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(cols, minlength=shape[1]))
+    return sparse.csc_matrix(
+        (np.asarray(probs, dtype=float)[order], 
+         np.asarray(rows, dtype=np.int64)[order], indptr), shape=shape)
+
+
+def compile_transitions(forward_P, state_list, action_dict):
+    """ Compile forward transition dictionaries into sparse kernels.
+
+    Args:
+        forward_P: list. [d_t] for t = 0...T-1
+            d_t: dict. {s: P_ts} for s in States
+                P_ts: dict. {a: (s_list, p_list)} for a in Actions.
+        state_list: list of states.
+        action_dict: dict. {s: [a_k]} list of actions available in s.
+    Returns:
+        mdp: a compiled_mdp object. The destinations of each state-action
+            keep their order in forward_P.
+    """
+    state_index = {s: i for i, s in enumerate(state_list)}
+    sa_index = {}
+    for s in state_list:
+        for a in action_dict[s]:
+            sa_index[(s, a)] = len(sa_index)
+    S = len(state_index)
+    SA = len(sa_index)
+    kernels = []
+    for P_t in forward_P:
+        rows, cols, probs = [], [], []
+        for s, P_ts in P_t.items():
+            for a, (dests, p_list) in P_ts.items():
+                i = sa_index[(s, a)]
+                rows.extend(state_index[dest] for dest in dests)
+                cols.extend(i for _ in dests)
+                probs.extend(p_list)
+        kernels.append(forward_kernel(rows, cols, probs, (S, SA)))
+    return compiled_mdp(state_list, action_dict, kernels)
+
+
+def save_compiled(filename, mdp, **arrays):
+    """ Save a compiled_mdp and additional arrays to an uncompressed .npz file.
+    States must be (zone_ind, queue_level) tuples of ints.
+    
+    The file is written to a temporary name and moved into place, so that 
+    concurrent readers never see a partial file. The kernels are saved as 
+    their transposes P_T, which keep the order of the destinations.
+    """
+    kernel_nnz = np.array([0] + [P_T_t.nnz for P_T_t in mdp.P_T])
+    arrays.update({
+        'state_list': np.array(mdp.state_list, dtype=np.int64),
+        'sa_state': mdp.sa_state,
+        'sa_action': mdp.sa_action,
+        'kernel_offsets': np.cumsum(kernel_nnz),
+        'kernel_data': np.concatenate([P_T_t.data for P_T_t in mdp.P_T]),
+        'kernel_indices': np.concatenate(
+            [P_T_t.indices for P_T_t in mdp.P_T]),
+        'kernel_indptr': np.stack([P_T_t.indptr for P_T_t in mdp.P_T])})
+    if mdp.shared is not None:
+        arrays.update({'shared_data': mdp.shared_T.data, 
+                       'shared_indices': mdp.shared_T.indices,
+                       'shared_indptr': mdp.shared_T.indptr})
+    temp_filename = f'{filename}.{os.getpid()}.tmp'
+    with open(temp_filename, 'wb') as npz_file:
+        np.savez(npz_file, **arrays)
+    os.replace(temp_filename, filename)
+
+
+def load_arrays(filename, mmap_mode='r'):
+    """ Load the arrays of an uncompressed .npz file. With a mmap_mode, the
+    arrays are memory-mapped from the file instead of read into memory.
+    
+    Returns:
+        arrays: dict. {name: array}.
+    """
+    arrays = {}
+    with zipfile.ZipFile(filename) as archive, open(filename, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-len('.npy')]
+            if mmap_mode is None or info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as npy_file:
+                    arrays[name] = np.lib.format.read_array(npy_file)
+                continue
+            # skip the local file header to the start of the .npy file
+            f.seek(info.header_offset)
+            local_header = f.read(30)
+            name_length, extra_length = struct.unpack('<HH', 
+                                                      local_header[26:30])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            if np.prod(shape) == 0:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(
+                    filename, dtype=dtype, mode=mmap_mode, shape=shape, 
+                    order='F' if fortran else 'C', offset=f.tell())
+    return arrays
+
+
+def load_compiled(filename, mmap_mode='r'):
+    """ Load a compiled_mdp saved with save_compiled. 
+    
+    Returns:
+        mdp: a compiled_mdp object whose kernels are memory-mapped if 
+            mmap_mode is given.
+        arrays: dict. The additional arrays passed to save_compiled.
+    """
+    arrays = load_arrays(filename, mmap_mode)
+    state_list = [tuple(s) for s in arrays.pop('state_list').tolist()]
+    sa_state = arrays.pop('sa_state')
+    sa_action = arrays.pop('sa_action')
+    action_dict = {s: [] for s in state_list}
+    for s_ind, a in zip(sa_state.tolist(), sa_action.tolist()):
+        action_dict[state_list[s_ind]].append(a)
+    offsets = arrays.pop('kernel_offsets')
+    data = arrays.pop('kernel_data')
+    indices = arrays.pop('kernel_indices')
+    indptr = arrays.pop('kernel_indptr')
+    # the saved transposes are the CSC arrays of the kernels
+    kernels = [sparse.csc_matrix((data[offsets[t]:offsets[t+1]], 
+                                  indices[offsets[t]:offsets[t+1]], 
+                                  indptr[t]), 
+                                 shape=(len(state_list), len(sa_state)))
+               for t in range(len(indptr))]
+    shared = None
+    if 'shared_indptr' in arrays:
+        shared = sparse.csc_matrix(
+            (arrays.pop('shared_data'), arrays.pop('shared_indices'), 
+             arrays.pop('shared_indptr')), 
+            shape=(len(state_list), len(sa_state)))
+    return compiled_mdp(state_list, action_dict, kernels, shared), arrays
@@ -40,7 +40,6 @@ import matplotlib.pyplot as plt
 import util.trip as trip
 import models.taxi_dynamics.visualization as visual
 from haversine import haversine
-import pickle
 import os
 
 
@@ -78,16 +77,16 @@ Man_zones = np.asarray(Man_zones)
 #%% TAU CALCULATION %%#
 
 def tau_calculation(borough_time_sorted_trips):
-    tau = np.mean(np.array([trips.trip_time for trips in borough_time_sorted_trips]))
+    tau = np.mean(borough_time_sorted_trips['trip_time'])
     
     return tau
 
 #%% ZONE HISTOGRAM %%#
 # Define trip occurence plotting function
-# Input: list of trips beginning in borough of interest | array of zones in borough of interest | string containing borough name
+# Input: TripBatch of trips beginning in borough of interest | array of zones in borough of interest | string containing borough name
 # Output: Array and plot of trip occurrences per borough zone 
 def trip_plot(borough_trips, zone_list, borough_name, plot=False):
-    hist = np.histogram([t.zone_pu for t in borough_trips], bins = zone_list)
+    hist = np.histogram(borough_trips['zone_pu'], bins = zone_list)
 
     if plot:    
         zone_names = [str(x) for x in np.delete(zone_list, -1)]
@@ -124,32 +123,25 @@ def state_transition_matrix(borough_trip_list, borough_hist):
     freq = borough_hist[0]
     zones = np.delete(borough_hist[1], -1)
     
-    borough_trip_list.sort(key = lambda x: x.zone_pu)
-    
     state_matrix = np.empty([len(zones), len(zones)])
     count_matrix = np.empty([len(zones), len(zones)])
     array_total = []
     
-    index = 0
     for i in range(len(zones)):
-        index2 = index+freq[i]
         total_ = freq[i]
         array_total.append(total_)
-        trips_ = borough_trip_list[index:index2]
+        trips_do = borough_trip_list['zone_do'][
+            borough_trip_list['zone_pu'] == zones[i]]
         for j in range(len(zones)):
             if total_ == 0:
                 state_matrix[i,j] = 0
                 count_matrix[i,j] = 0
-            counter = 0
-            for trip_instance in trips_:
-                if trip_instance.zone_do == zones[j]:
-                    counter += 1
+            counter = np.sum(trips_do == zones[j])
             state_matrix[i,j] = counter/total_    
             count_matrix[i,j] = counter            
-        index += freq[i]
     
-    np.nan_to_num(state_matrix)
-    np.nan_to_num(count_matrix)
+    state_matrix = np.nan_to_num(state_matrix)
+    count_matrix = np.nan_to_num(count_matrix)
     
     return [state_matrix, count_matrix]
      
@@ -158,13 +150,13 @@ def state_transition_matrix(borough_trip_list, borough_hist):
 def partition(borough_trip_list, partition_hist):
     freq = partition_hist[0]
     time_zones = partition_hist[1]
-    borough_trip_list.sort(key = lambda x: x.putime)
+    time_order = np.argsort(borough_trip_list['putime'], kind='stable')
     
     trip_partitions = [[] for i in range(len(time_zones)-1)]
     index = 0
     for count,_ in enumerate(trip_partitions):
         index2 = index + freq[count]
-        trip_partitions[count] = borough_trip_list[index:index2]
+        trip_partitions[count] = borough_trip_list[time_order[index:index2]]
         index += freq[count]
 
     return trip_partitions
@@ -186,36 +178,23 @@ if compute_distance:
     np.savetxt('models/taxi_data/distance_matrix.csv', distance_matrix, delimiter=',')
     
 #%% TRIPS %%#
-# Create list of trip objects
+# Create the batch of trips
 for month in months:
     month_int = '12' if month == 'dec' else '01'
     data_filename = f"models/taxi_data/yellow_tripdata_2019-{month_int}.csv" 
-    
-    print(f' opening file {data_filename}')
-    if os.path.exists(data_filename):
-        new_york_2019 = pd.read_csv(data_filename, header=0).to_numpy()
-    else:
-        parquet_file = f"models/taxi_data/yellow_tripdata_2019-{month_int}.parquet" 
-        df = pd.read_parquet(parquet_file)
-        print('found parquet')
-        df.to_csv(data_filename)
-        print(f'converted parquet to file {data_filename}')
-        new_york_2019 = df.to_numpy()
-    trips = []
-    for i in range(new_york_2019.shape[0]):
-        print(f'\r creating trip objects {i}/{new_york_2019.shape[0]}     ', end='')
-        trips.append(trip.Trip(new_york_2019[i]))
-    print('')
-    print('getting out boroughs: ')
-    manhattan_trips = [t for t in trips 
-                       if t.zone_pu in Man_zones and t.zone_do in Man_zones \
-                           and t.putime > 9 and t.putime < 12]
-    # Save trips into a pickle
-    output_filename = f'models/taxi_data/manhattan_trips_{month}.pickle'
-    print(f'saving trip list {output_filename} ')    
-    open_file = open(output_filename, 'wb')
-    pickle.dump(manhattan_trips, open_file)
-    open_file.close()    
+    if not os.path.exists(data_filename):
+        data_filename = f"models/taxi_data/yellow_tripdata_2019-{month_int}.parquet" 
+    # pick up counts and trip distances of the time partitions used below
+    trip_counters = {
+        p_min: trip.trip_counter(Man_zones, np.linspace(9, 12, (15 if p_min == 12 else 12) + 1))
+        for p_min in partition_amount}
+    print(f' streaming file {data_filename}')
+    manhattan_trips = trip.stream_trips(data_filename, Man_zones, 9, 12, 
+                                        trip_counters.values())
+    # Save trips into a record array
+    output_filename = f'models/taxi_data/manhattan_trips_{month}.npz'
+    print(f'saving trip batch {output_filename} ')    
+    trip.save_trips(output_filename, manhattan_trips)
     # some extra code to do plotting/average compuations
     # Man_tau = tau_calculation(Man_trips_rush_hour)   
     # Man_trip_hist = trip_plot(Man_trips_rush_hour, Man_zones, area)   
@@ -230,38 +209,24 @@ for month in months:
         print('creating time partitioned transitions')
         time_partition_bins = np.linspace(9,12,t_min+1)
         
-        # # Create histogram for number of trips per 12 minute partition
-        partitioned_hist = np.histogram([
-            t.putime for t in manhattan_trips], bins=time_partition_bins)
-        # List of lists containing trips corresponding to each partition
-        rush_hour_trips_parted = partition(manhattan_trips, partitioned_hist) 
-    
-        # List of state matrices
-        Man_partitioned_transitions = [[] for _ in rush_hour_trips_parted]
-        
-        for count,_ in enumerate(Man_partitioned_transitions):
-            part_hist = trip_plot(rush_hour_trips_parted[count], 
-                                  Man_zones, area)
-            Man_partitioned_transitions[count] = state_transition_matrix(
-                rush_hour_trips_parted[count], part_hist)
+        # origin-destination counts and probabilities of every partition
+        count_kernel, transition_kernel = trip.od_matrices(
+            manhattan_trips, np.delete(Man_zones, -1), time_partition_bins)
         # state transition kernel for each timestep    
         print(f'saving transition file {transition_csv_filename}')
-        transition_kernel = np.array(
-            [matrix[0] for matrix in Man_partitioned_transitions]) 
         transition_df = pd.DataFrame(np.hstack(transition_kernel))
         transition_df.to_csv(transition_csv_filename, index = False)
         
         # state trip count matrix for each timestep
         print(f'saving count kernel file {count_csv_filename}')
-        count_kernel = np.array([mat[1] for mat in Man_partitioned_transitions]) 
         count_df = pd.DataFrame(np.hstack(count_kernel))
         count_df.to_csv(count_csv_filename, index = False)
     
         #%% Weighted Average Trip Distance Per Origin State %%#
-        weighted_average_distance = [[] for _ in rush_hour_trips_parted]
+        weighted_average_distance = [[] for _ in transition_kernel]
         
-        for count,_ in enumerate(rush_hour_trips_parted):
-            weights = Man_partitioned_transitions[count][0]
+        for count,_ in enumerate(transition_kernel):
+            weights = transition_kernel[count]
             array_ = []
             for i in range(len(Man_zones)-1):
                 array_.append(np.matmul(weights[i,:], distance_matrix[:,i]))
@@ -269,6 +234,11 @@ for month in months:
             weighted_average_distance[count] = array_
         print(f'saving average weight file {avg_filename}')
         np.savetxt(avg_filename, weighted_average_distance, delimiter=',')
+        # average recorded trip distance (mi) per origin state
+        trip_distance_filename = f'models/taxi_data/trip_distance_{month}_{t_min}min.csv'
+        print(f'saving trip distance file {trip_distance_filename}')
+        np.savetxt(trip_distance_filename, 
+                   trip_counters[p_min].average_distance(), delimiter=',')
     
     
 
@@ -6,6 +6,10 @@ Created on Thu Jul 28 15:07:40 2022
 """
 import models.taxi_dynamics.manhattan_transition as m_trans
 import models.taxi_dynamics.manhattan_cost as m_cost
+import models.taxi_dynamics.manhattan_neighbors as m_neighbors
+import models.compiled_mdp as c_mdp
+import hashlib
+import os
 import pickle
 import pandas as pd
 import numpy as np
@@ -16,13 +20,34 @@ directory = ''
 # 'C:/Users/Sarah Li/Desktop/code/mdpcg/V3/' 
 month = 'jan' # 'dec' # 
 ints = 15 # 15 min
-trips_filename = directory+f'models/taxi_data/manhattan_transitions_{month}_{ints}min.pickle'
-count_filename = directory+f'models/taxi_data/count_kernel_{month}_{ints}min.csv'
-avg_filename = directory +f'models/taxi_data/weighted_average_{month}_{ints}min.csv'
+def data_filenames(month, ints):
+    """ Return the transition, count and average distance files of a month
+    ('jan' or 'dec') at ints (12 or 15) minute intervals."""
+    return (
+        directory+f'models/taxi_data/manhattan_transitions_{month}_{ints}min.pickle',
+        directory+f'models/taxi_data/count_kernel_{month}_{ints}min.csv',
+        directory +f'models/taxi_data/weighted_average_{month}_{ints}min.csv')
+trips_filename, count_filename, avg_filename = data_filenames(month, ints)
+cache_directory = directory + 'models/taxi_data/cache/'
+# source files whose changes invalidate the cached games
+model_sources = [m_trans.__file__, m_cost.__file__, m_neighbors.__file__,
+                 c_mdp.__file__, __file__]
+
+def cache_key(filenames, **parameters):
+    """ Content address of a compiled game: a hash of the data files, the 
+    model source files and the constructor parameters."""
+    key = hashlib.sha256()
+    for filename in list(filenames) + model_sources:
+        with open(filename, 'rb') as source_file:
+            key.update(hashlib.sha256(source_file.read()).digest())
+    key.update(repr(sorted(parameters.items())).encode())
+    return key.hexdigest()[:20]
+
 class queue_game:
     
     def __init__(self, total_mass = 1, epsilon=0.1, 
-                 strictly_convex=True, uniform_density=False, flat=False):
+                 strictly_convex=True, uniform_density=False, flat=False,
+                 month=month, ints=ints, cache=False):
         """  Initialize a queued MDP game for rideshare drivers. The  
         transition dynamics and costs are built on the ride demand data from
         New York City's Taxi and Limousine Commission.
@@ -41,6 +66,18 @@ class queue_game:
             DESCRIPTION. The default is False.
         flat : TYPE, optional
             DESCRIPTION. The default is False.
+        month : str, optional
+            Month of the trip data, 'jan' or 'dec'. The default is 'jan'.
+        ints : int, optional
+            Length of a time step in minutes, 12 or 15. The default is 15.
+        cache : bool, optional
+            If True, the compiled kernels, cost arrays and initial density 
+            are loaded from (or saved to) a memory-mapped .npz file in 
+            cache_directory, keyed by cache_key. The transition and cost 
+            dictionaries are then only rebuilt when accessed. The file is 
+            written to a temporary name and moved into place, so parallel 
+            builds of the same game do not read partial files. The default 
+            is False.
 
         Returns
         -------
@@ -48,52 +85,181 @@ class queue_game:
 
         """
         self.mass = total_mass
-        trips_file = open(trips_filename, 'rb')
-        m_transitions = pickle.load(trips_file)
-        trips_file.close()
         self.flat = flat
-        if self.flat:
-            mdp = m_trans.transition_kernel_dict_flat(epsilon, m_transitions)
+        filenames = data_filenames(month, ints)
+        self._trips_filename = filenames[0]
+        cache_file = None
+        if cache:
+            key = cache_key(filenames, epsilon=epsilon, flat=flat, 
+                            month=month, ints=ints)
+            cache_file = cache_directory + f'queue_game_{key}.npz'
+        if cache_file is not None and os.path.exists(cache_file):
+            self.compiled, arrays = c_mdp.load_compiled(cache_file)
+            self.R, self.C = arrays['R'], arrays['C']
+            self.cost_basis = m_cost.cost_basis(
+                arrays['kind'], arrays['demand'], arrays['trip_mi'], 
+                arrays['neighbor_mi'])
+            self.avg_dist = arrays['avg_dist']
+            t0_unit = arrays['t0_unit']
+            # dictionary forms are rebuilt from the arrays when accessed
+            self._forward_P = None
+            self._backward_P = None
+            self._costs = None
+            self._transition_data = None
+        else:
+            self.build(epsilon, *filenames)
+            t0_unit = None
+        self.setup()
+        
+        if t0_unit is None:
+            t0_unit = self.compiled.s_vector(self.t0_density(True))/self.mass
+            if cache_file is not None:
+                os.makedirs(cache_directory, exist_ok=True)
+                c_mdp.save_compiled(cache_file, self.compiled, R=self.R, 
+                                    C=self.C, avg_dist=self.avg_dist, 
+                                    t0_unit=t0_unit, 
+                                    **vars(self.cost_basis))
+        if uniform_density:
+            self.t0 = self.compiled.s_dict(self.mass * t0_unit)
         else:
-            mdp = m_trans.transition_kernel_dict(epsilon, m_transitions)
-        self.forward_P = mdp[0]
-        self.backward_P = mdp[1]
-        self.state_list = mdp[2]
-        self.action_dict = mdp[3]
+            self.t0 = self.t0_density(uniform_density) 
+        
+    @classmethod
+    def from_compiled(cls, compiled, cost_basis, avg_dist, total_mass=1, 
+                      uniform_density=False):
+        """ Initialize a queued MDP game from its compiled transitions and
+        cost basis instead of the Manhattan trip data, see city_game.
+        
+        Parameters
+        ----------
+        compiled : compiled_mdp
+            Transitions, e.g. from manhattan_transition.
+            transition_kernel_compiled.
+        cost_basis : manhattan_cost.cost_basis
+            Cost terms, e.g. from manhattan_cost.congestion_cost_basis.
+        avg_dist : array
+            Average trip distance [t, state ind].
+        total_mass : float, optional
+            Mass of the driver fleet. The default is 1.
+        uniform_density : bool, optional
+            Uniform initial density over the zones. The default is False.
+
+        Returns
+        -------
+        game : queue_game.
 
-        self.sa_list = mdp[4]
+        """
+        game = cls.__new__(cls)
+        game.mass = total_mass
+        game.flat = all(s[1] == 0 for s in compiled.state_list)
+        game._trips_filename = None
+        game._forward_P = None
+        game._backward_P = None
+        game._transition_data = None
+        game.compiled = compiled
+        game.cost_basis = cost_basis
+        game.avg_dist = avg_dist
+        game.set_cost_parameters()
+        game.setup()
+        game.t0 = game.t0_density(uniform_density)
+        return game
+        
+    def setup(self):
+        """ Set the state and action attributes from self.compiled."""
+        self.state_list = self.compiled.state_list
+        self.action_dict = self.compiled.action_dict
+        self.sa_list = self.compiled.sa_list
         self.z_list = [s[0] for s in self.state_list]
         self.z_list = list(set(self.z_list)) # get unique values from z_list
-        self.T = len(self.forward_P)
+        self.T = self.compiled.T
         
         print(f' number of zones {len(self.z_list)}')
         print(f' number of states {len(self.state_list)}')
         print(f' length of time horizon is {self.T}')
-        self.max_q = 8 if self.T == 15 else 7
-        if self.flat:
-            self.max_q = 1
+        self.max_q = 1 + max([s[1] for s in self.state_list])
         self.constrain_queue = None
+        # legacy: the last action, one more than the most neighbors of a 
+        # zone, is picking up riders
+        self.pu_action = int(self.compiled.sa_action.max())
         
-        self.t0 = self.t0_density(uniform_density) 
         self.tolls = None
+        self.toll_index = None
+        self.toll_value = None
+        self.social_toll_index = None
+        self.social_toll_value = None
+        self.constrained_states = None
+        self.constrained_val = None
+        
+    def build(self, epsilon, trips_filename, count_filename, avg_filename):
+        """ Build the compiled transitions and the cost arrays from the trip
+        data."""
+        trips_file = open(trips_filename, 'rb')
+        m_transitions = pickle.load(trips_file)
+        trips_file.close()
+        self.compiled = m_trans.transition_kernel_compiled(
+            epsilon, m_transitions, self.flat)
+        # dictionary forms are rebuilt from the kernels when accessed
+        self._forward_P = None
+        self._backward_P = None
+        z_number = len(set([s[0] for s in self.compiled.state_list]))
 
-        demand_rate = m_cost.demand_rate(count_filename, self.T,  len(self.z_list))
+        demand_rate = m_cost.demand_rate(count_filename, self.compiled.T, 
+                                         z_number)
         self.avg_dist = pd.read_csv(avg_filename, header=None).values
         
-        self.costs = m_cost.congestion_cost_dict(
-            demand_rate, self.forward_P, self.avg_dist, epsilon=1e-3)
-        self.transition_data = m_transitions
-        self.constrained_states = None
-        self.constrained_val = None
+        self.cost_basis = m_cost.congestion_cost_basis(
+            demand_rate, self.compiled, self.avg_dist)
+        self.set_cost_parameters()
+        self._transition_data = m_transitions
+        
+    def set_cost_parameters(self, params=None, epsilon=1e-3):
+        """ Recompute the costs for new congestion parameters (see 
+        manhattan_cost.congestion_parameters) without rebuilding the game.
+        """
+        # array form of the costs, indexed by [t, self.compiled.sa_index]
+        self.R, self.C = m_cost.congestion_cost_arrays(
+            self.cost_basis, params, epsilon)
+        self._costs = None
+        
+    @property
+    def forward_P(self):
+        if self._forward_P is None:
+            self._forward_P = self.compiled.forward_dicts()
+        return self._forward_P
+    
+    @property
+    def backward_P(self):
+        if self._backward_P is None:
+            self._backward_P = self.compiled.backward_dicts()
+        return self._backward_P
+    
+    @property
+    def costs(self):
+        if self._costs is None:
+            self._costs = self.compiled.cost_dicts(self.R, self.C)
+        return self._costs
+    
+    @property
+    def transition_data(self):
+        if self._transition_data is None and self._trips_filename is not None:
+            trips_file = open(self._trips_filename, 'rb')
+            self._transition_data = pickle.load(trips_file)
+            trips_file.close()
+        return self._transition_data
         
     def get_strong_convexity(self):
         min_R = 100
-        for t in range(len(self.costs)):
-            min_R = min([r[0] if r[0] != 0 else 999999 
-                         for r in self.costs[t].values()] + [min_R])
+        if np.any(self.R != 0):
+            min_R = min(np.min(self.R[self.R != 0]), min_R)
         return min_R
     
     def get_social_cost(self, density):
+        if isinstance(density, np.ndarray):
+            potential_val = np.sum(self.R * density**2 + self.R * density)
+            if self.tolls is not None:
+                potential_val += self.social_toll_value.dot(
+                    density.reshape(-1)[self.social_toll_index])
+            return potential_val
         potential_val = sum([sum([self.costs[t][st][0] * density[t][st]**2 \
                 + self.costs[t][st][0] * density[t][st] 
                 for st in self.costs[t].keys()]) 
@@ -107,6 +273,13 @@ class queue_game:
             
         return potential_val
     def get_potential(self, density):
+        if isinstance(density, np.ndarray):
+            potential_val = np.sum(0.5 * self.R * density**2 
+                                   + self.C * density)
+            if self.tolls is not None:
+                potential_val += self.toll_value.dot(
+                    density.reshape(-1)[self.toll_index])
+            return potential_val
         potential_val = sum([sum([  
             0.5*self.costs[t][st][0] * density[t][st]**2 \
                 + self.costs[t][st][1] * density[t][st] 
@@ -116,12 +289,17 @@ class queue_game:
             for zt in self.tolls.keys():
                 z_ind = zt[0]
                 t_ind = zt[1]
-                for a in [7]:# self.action_dict[z_ind]:
+                for a in [self.pu_action]:# self.action_dict[z_ind]:
                     potential_val += self.tolls[zt]*density[t_ind][(z_ind, a)]
             
         return potential_val
         
     def get_gradient(self, density):
+        if isinstance(density, np.ndarray):
+            grad = self.R * density + self.C
+            if self.tolls is not None:
+                np.add.at(grad.reshape(-1), self.toll_index, self.toll_value)
+            return grad
         grad = []
         for t in range(len(self.costs)):
             grad.append({})
@@ -130,7 +308,7 @@ class queue_game:
                     self.costs[t][st][1] 
         if self.tolls is not None:
             for zt in self.tolls.keys():
-                for a in [7]: # self.action_dict[zt[0]]:
+                for a in [self.pu_action]: # self.action_dict[zt[0]]:
                     grad[zt[1]][(zt[0], a)] += self.tolls[zt]
                 
         return grad
@@ -173,11 +351,22 @@ class queue_game:
 
             
     def propagate(self, sa_density, t):
+        """ Propagate a state-action density at time t to the state density 
+        at time t+1. 
         
-        next_density = {s: sum([prob* sa_density[orig_s] 
-                                for orig_s, prob in zip(val[0],val[1])]) 
-                        for s, val in self.backward_P[t].items()}
-        return next_density
+        Input:
+            sa_density: dict {sa: d_sa} or array of length SA indexed by
+                self.compiled.sa_index.
+            t: int. Time step.
+        Output:
+            next_density: dict {s: d_s} or array of length S, matching the 
+                type of sa_density.
+        """
+        if isinstance(sa_density, np.ndarray):
+            return self.compiled.propagate(sa_density, t)
+        next_density = self.compiled.propagate(
+            self.compiled.sa_vector(sa_density), t)
+        return self.compiled.s_dict(next_density)
 
     def get_zone_densities(self, sa_density, include_queues=False):
         """ Get the drivers not in queue in each zone 
@@ -256,6 +445,21 @@ class queue_game:
         
     def update_tolls(self, tau):
         self.tolls = {k: tau_k for k, tau_k in tau.items()}
+        # sparse form of the tolls for array densities: the potential and
+        # gradient toll the pick up action, the social cost tolls all actions
+        self.toll_index, self.toll_value = self.compiled.toll_arrays(
+            self.tolls, [self.pu_action])
+        self.social_toll_index, self.social_toll_value = \
+            self.compiled.toll_arrays(self.tolls)
+            
+    def toll_array(self, tau):
+        """ Return the tolls tau = {(s, t): tau_st} as a dense (T, SA) array
+        of the tolls added to the gradient, without changing self.tolls."""
+        toll_index, toll_value = self.compiled.toll_arrays(
+            tau, [self.pu_action])
+        tolls = np.zeros((self.T, self.compiled.SA))
+        np.add.at(tolls.reshape(-1), toll_index, toll_value)
+        return tolls
             
     def set_constraints(self, constrained_zones, constrained_val, 
                         with_queue=False):
@@ -277,27 +481,49 @@ class queue_game:
             return gradient, np.linalg.norm(grad_arr, 2)
         else:
             return gradient
-        
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
-                
\ No newline at end of file
+
+
+def city_game(zone_neighbors, transitions_list, ride_demand, avg_trip_dist,
+              total_mass=1, epsilon=0.1, flat=False, uniform_density=False,
+              zone_geography=None, max_queue_level=None):
+    """ Build a queued MDP game over any set of taxi zones, e.g. the zones of 
+    every borough with visualization.get_zone_neighbors(). 
+    
+    Parameters
+    ----------
+    zone_neighbors : dict
+        {zone_ind: [neighbor zone_ind]} adjacency graph of the zones.
+    transitions_list : list
+        Trip transitions between the zones, see 
+        manhattan_transition.transition_kernel_dict.
+    ride_demand : array
+        Ride demand [t, zone], zones in the order of zone_neighbors.
+    avg_trip_dist : array
+        Average trip distance in km [t, zone].
+    total_mass : float, optional
+        Mass of the driver fleet. The default is 1.
+    epsilon : float, optional
+        Probability of not reaching the targeted neighbor. The default is 0.1.
+    flat : bool, optional
+        If True, drivers have no queue levels. The default is False.
+    uniform_density : bool, optional
+        Uniform initial density over the zones. The default is False.
+    zone_geography : dict, optional
+        {zone_ind: (latitude, longitude)}. The default is the zone 
+        locations of every borough.
+    max_queue_level : int, optional
+        Number of queue levels of each zone, see 
+        manhattan_transition.transition_kernel_compiled.
+
+    Returns
+    -------
+    game : queue_game.
+
+    """
+    compiled = m_trans.transition_kernel_compiled(
+        epsilon, transitions_list, flat, zone_neighbors, 
+        max_queue_level=max_queue_level)
+    basis = m_cost.congestion_cost_basis(
+        ride_demand, compiled, avg_trip_dist, zone_neighbors, zone_geography)
+    return queue_game.from_compiled(compiled, basis, avg_trip_dist, 
+                                    total_mass, uniform_density)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 16:10:45 2026
+
+Synthetic queued MDP games of any size, for scaling experiments without the
+TLC trip data. Zones are random points in a box around New York, each zone
+is adjacent to its nearest zones, and the pick up destinations, ride demand
+and trip distances are random. Every instance is determined by its seed.
+
+@author: Sarah Li
+"""
+import numpy as np
+from scipy.spatial import cKDTree
+import models.queued_mdp_game as queued_game
+
+# latitude and longitude box of the synthetic zones
+latitudes = (40.55, 40.90)
+longitudes = (-74.05, -73.75)
+
+
+def zone_adjacency(zones, degree, rng):
+    """ Random zone locations and a planar-ish adjacency between them: each
+    zone is adjacent to its degree nearest zones, and adjacency is made
+    symmetric, so every zone has at least degree neighbors.
+
+    Parameters
+    ----------
+    zones : int
+        Number of zones, indexed 1 to zones.
+    degree : int
+        Number of nearest zones each zone is adjacent to, at least 2.
+    rng : numpy.random.Generator
+
+    Returns
+    -------
+    zone_neighbors : dict
+        {zone_ind: [neighbor zone_ind]}, neighbors in ascending order.
+    zone_geography : dict
+        {zone_ind: (latitude, longitude)}.
+
+    """
+    if degree < 2 or degree >= zones:
+        raise ValueError(f'degree {degree} must be in [2, {zones - 1}].')
+    locations = np.column_stack([rng.uniform(*latitudes, zones),
+                                 rng.uniform(*longitudes, zones)])
+    # nearest zones in a locally flat projection of the box
+    scale = np.array([1, np.cos(np.radians(np.mean(latitudes)))])
+    _, nearest = cKDTree(locations * scale).query(locations * scale,
+                                                  degree + 1)
+    neighbors = [set() for _ in range(zones)]
+    for z, nearest_z in enumerate(nearest):
+        for n in nearest_z[1:]:
+            neighbors[z].add(int(n))
+            neighbors[int(n)].add(z)
+    zone_neighbors = {z + 1: sorted([n + 1 for n in neighbors[z]])
+                      for z in range(zones)}
+    zone_geography = {z + 1: tuple(locations[z]) for z in range(zones)}
+    return zone_neighbors, zone_geography
+
+
+def pick_up_transitions(zone_neighbors, T, max_queue_level, destinations,
+                        rng):
+    """ Random pick up destinations in the format of transitions_list of
+    manhattan_transition.transition_kernel_dict.
+
+    Parameters
+    ----------
+    zone_neighbors : dict
+        {zone_ind: [neighbor zone_ind]}.
+    T : int
+        Number of time steps.
+    max_queue_level : int
+        Number of queue levels, destination queue levels are below it.
+    destinations : int
+        Number of random (zone, queue level) destinations drawn for each
+        zone and time step. Repeated draws are merged.
+    rng : numpy.random.Generator
+
+    Returns
+    -------
+    transitions_list : list
+        [d_t] for t = 0...T-1, d_t: {zone_ind: {(zone_ind, queue_level):
+        probability}}.
+
+    """
+    zones = np.array(list(zone_neighbors.keys()))
+    transitions_list = []
+    for t in range(T):
+        transitions_t = {}
+        for z in zones.tolist():
+            dest_zones = rng.choice(zones, destinations)
+            dest_queues = rng.integers(0, max_queue_level, destinations)
+            probabilities = rng.random(destinations)
+            probabilities /= probabilities.sum()
+            transitions_t[z] = {}
+            for dest, p in zip(zip(dest_zones.tolist(), dest_queues.tolist()),
+                               probabilities.tolist()):
+                transitions_t[z][dest] = transitions_t[z].get(dest, 0) + p
+        transitions_list.append(transitions_t)
+    return transitions_list
+
+
+def synthetic_game(zones=60, T=12, max_queue_level=7, degree=4,
+                   destinations=60, total_mass=10000, epsilon=0.1,
+                   flat=False, uniform_density=True, seed=0,
+                   zone_neighbors=None, zone_geography=None):
+    """ A queue_game with random zones, trips and costs.
+
+    Parameters
+    ----------
+    zones : int, optional
+        Number of zones. The default is 60.
+    T : int, optional
+        Number of time steps. The default is 12.
+    max_queue_level : int, optional
+        Number of queue levels of each zone. The default is 7.
+    degree : int, optional
+        Nearest zones each zone is adjacent to. The default is 4.
+    destinations : int, optional
+        Random pick up destinations per zone and time step. The default
+        is 60.
+    total_mass : float, optional
+        Mass of the driver fleet. The default is 10000.
+    epsilon : float, optional
+        Probability of not reaching the targeted neighbor. The default
+        is 0.1.
+    flat : bool, optional
+        If True, drivers have no queue levels. The default is False.
+    uniform_density : bool, optional
+        Uniform initial density over the zones. The default is True.
+    seed : int, optional
+        Seed of every random draw. The default is 0.
+    zone_neighbors, zone_geography : dict, optional
+        A given zone adjacency and its zone locations, e.g.
+        manhattan_neighbors.zone_neighbors, instead of random zones. zones
+        and degree are then ignored.
+
+    Returns
+    -------
+    game : queue_game.
+
+    """
+    rng = np.random.default_rng(seed)
+    if zone_neighbors is None:
+        zone_neighbors, zone_geography = zone_adjacency(zones, degree, rng)
+    if flat:
+        max_queue_level = 1
+    transitions_list = pick_up_transitions(
+        zone_neighbors, T, max_queue_level, destinations, rng)
+    ride_demand = rng.integers(0, 50, (T, len(zone_neighbors)))
+    avg_trip_dist = rng.uniform(1, 5, (T, len(zone_neighbors)))
+    return queued_game.city_game(
+        zone_neighbors, transitions_list, ride_demand, avg_trip_dist,
+        total_mass, epsilon, flat, uniform_density, zone_geography,
+        max_queue_level)
@@ -13,7 +13,7 @@ conda install -c conda-forge haversine
 import numpy as np
 import models.taxi_dynamics.manhattan_neighbors as manhattan
 import models.taxi_dynamics.visualization as geography
-from haversine import haversine
+from haversine import haversine, haversine_vector
 import pandas as pd
 
 _km_to_mi = 0.621371 
@@ -108,7 +108,7 @@ def congestion_cost_dict(ride_demand, forward_trans, avg_trip_dist, epsilon=0):
                     # going to neighbor        
                     elif len(forward_trans[t][z_j][a][0]) > 0: 
                         n_zone = forward_trans[t][z_j][a][0][0][0]
-                        s_latlon = zone_geo[n_zone]
+                        s_latlon = zone_geo[z_j[0]]
                         n_latlon = zone_geo[n_zone]
                         # haversine returns distance between 
                         # two lat-lon tuples in km. 0.621371 converts km to mi.
@@ -122,6 +122,142 @@ def congestion_cost_dict(ride_demand, forward_trans, avg_trip_dist, epsilon=0):
     return cost_list
 
 
+def neighbor_distances(neighbors_dict, zone_geography):
+    """ Distance from each zone to each of its neighbors.
+    
+    Input:
+        neighbors_dict: dict, {zone_ind: [neighbor zone_ind]}.
+        zone_geography: dict, {zone_ind: (latitude, longitude)}.
+    Output:
+        distances: dict, {zone_ind: d_z}
+        d_z: array of the distances in miles from zone_ind to each neighbor,
+            in the order of neighbors_dict[zone_ind].
+    """
+    pairs = [(z, n) for z, neighbors in neighbors_dict.items() 
+             for n in neighbors]
+    origins = np.array([zone_geography[z] for z, _ in pairs])
+    dests = np.array([zone_geography[n] for _, n in pairs])
+    pair_miles = haversine_vector(origins, dests) * _km_to_mi
+    distances = {}
+    start = 0
+    for z, neighbors in neighbors_dict.items():
+        distances[z] = pair_miles[start:start + len(neighbors)]
+        start += len(neighbors)
+    return distances
+
+
+class cost_basis:
+    """ Parameter independent terms of the congestion cost of each 
+    state-action of a compiled MDP, as (T, SA) arrays.
+    
+    kind: the cost case of each state-action, one of the class constants.
+    demand: ride demand of the pick up state-actions.
+    trip_mi: average trip distance of the pick up state-actions in miles.
+    neighbor_mi: distance to the targeted neighbor in miles.
+    """
+    queue = 0 # queue level > 0, no cost
+    pick_up = 1
+    no_demand = 2 # pick up without ride demand
+    neighbor = 3 # going to neighbor
+    no_transition = 4 # neighbor action without destinations
+    
+    def __init__(self, kind, demand, trip_mi, neighbor_mi):
+        self.kind = kind
+        self.demand = demand
+        self.trip_mi = trip_mi
+        self.neighbor_mi = neighbor_mi
+
+
+def congestion_cost_basis(ride_demand, mdp, avg_trip_dist, 
+                          zone_neighbors=manhattan.zone_neighbors,
+                          zone_geography=None):
+    """ Precompute the parameter independent terms of the congestion cost 
+    of congestion_cost_dict, see congestion_cost_arrays.
+    
+    Input:
+        rider_demand: a [T][S] list of the rider demand in each state.
+        mdp: compiled_mdp, the compiled forward transitions.
+        avg_trip_dist: a [T][S] list of average trip distance in km, indexed
+            by state ind.
+        zone_neighbors: dict, {zone_ind: [neighbor zone_ind]} the zones of 
+            mdp. State ind is the order of the zones in zone_neighbors.
+        zone_geography: dict, {zone_ind: (latitude, longitude)}. If None, 
+            the zone locations of every borough.
+    Output:
+        basis: a cost_basis object.
+    """
+    T = mdp.T
+    pu_action = manhattan.most_neighbors(zone_neighbors)
+    state_ind  = manhattan.zone_to_state(zone_neighbors)
+    if zone_geography is None:
+        zone_geography = geography.get_zone_locations()
+    states = np.array(mdp.state_list)
+    sa_zone = states[mdp.sa_state, 0]
+    sa_queue = states[mdp.sa_state, 1]
+    sa_ind = np.array([state_ind[z] for z in sa_zone.tolist()], dtype=int)
+    
+    demand = np.array(ride_demand, dtype=float)[:T, sa_ind]
+    trip_mi = np.array(avg_trip_dist, dtype=float)[:T, sa_ind] * _km_to_mi
+    distances = neighbor_distances(zone_neighbors, zone_geography)
+    neighbor_mi = np.array(
+        [distances[z][a] if a < len(distances[z]) else 0. 
+         for z, a in zip(sa_zone.tolist(), mdp.sa_action.tolist())])
+    
+    has_transition = np.array([mdp.kernel(t).getnnz(axis=0) > 0 
+                               for t in range(T)])
+    kind = np.where(has_transition, cost_basis.neighbor, 
+                    cost_basis.no_transition)
+    is_pick_up = mdp.sa_action == pu_action
+    kind[:, is_pick_up] = np.where(demand[:, is_pick_up] > 0, 
+                                   cost_basis.pick_up, cost_basis.no_demand)
+    kind[:, sa_queue > 0] = cost_basis.queue
+    return cost_basis(kind, demand, trip_mi, 
+                      np.broadcast_to(neighbor_mi, (T, mdp.SA)).copy())
+
+
+def congestion_cost_arrays(basis, params=None, epsilon=0):
+    """ Generate the congestion cost of congestion_cost_dict as arrays.
+    Each ell_{tsa} = R_{tsa} y_{tsa} + C_{tsa}
+    
+    Only the affine terms are evaluated here, so the costs of different
+    congestion parameters are recomputed from the same basis.
+    
+    Input:
+        basis: a cost_basis object, see congestion_cost_basis.
+        params: congestion_parameters. If None, the default parameters.
+        epsilon: linear cost of going to neighbor or picking up without 
+            demand.
+    Output:
+        R: (T, SA) array, linear part of ell.
+        C: (T, SA) array, constant part of ell.
+    """
+    if params is None:
+        params = congestion_parameters()
+    kind = basis.kind
+    R = np.zeros(kind.shape)
+    C = np.zeros(kind.shape)
+    
+    pick_up = kind == cost_basis.pick_up
+    trip_mi = basis.trip_mi[pick_up]
+    m_pick_up = np.maximum(7, params.base_rate + params.rate_mi * trip_mi)
+    R[pick_up] = m_pick_up / (3 * basis.demand[pick_up] / 31)
+    C[pick_up] = -m_pick_up + params.k * trip_mi
+    
+    no_demand = kind == cost_basis.no_demand
+    R[no_demand] = epsilon
+    # assume drivers travel 1.609 miles circling
+    C[no_demand] = params.k * 1.609 * _km_to_mi 
+    
+    neighbor = kind == cost_basis.neighbor
+    R[neighbor] = epsilon
+    C[neighbor] = params.k * basis.neighbor_mi[neighbor]
+    
+    no_transition = kind == cost_basis.no_transition
+    R[no_transition] = 999999999
+    C[no_transition] = 999999999
+    return R, C
+
+
 def congestion_cost(ride_demand, T ,S, A, avg_trip_dist, epsilon = 0):
     """ Generate the congestion cost vector ell_{tsa}.
     Each ell_{tsa} = R_{tsa} y_{tsa} + C_{tsa}
@@ -5,8 +5,10 @@ Created on Wed Feb  3 21:31:21 2021
 @author: Sarah Li
 """
 import models.taxi_dynamics.manhattan_neighbors as manhattan
+import models.compiled_mdp as c_mdp
 import numpy as np
 import pandas as pd
+import scipy.sparse as sparse
 
 
 def random_demand_generation(T, S):
@@ -126,9 +128,7 @@ def transition_kernel_dict(epsilon, transitions_list):
         # legacy: last action is trying to pick up a rider                
         action_dict[s].append(max_action) # always add max_action
         
-    sa_list = []
-    for s in state_list:
-        sa_list = sa_list + [(s,a) for a in action_dict[s]]                    
+    sa_list = [(s, a) for s in state_list for a in action_dict[s]]
     
     
     for t_i in transitions_list:
@@ -264,14 +264,16 @@ def transition_kernel_dict_flat(epsilon, transitions_list):
         # legacy: last action is trying to pick up a rider                
         action_dict[s].append(pu_action) # always add max_action
         
-    sa_list = []
-    for s in state_list:
-        sa_list = sa_list + [(s,a) for a in action_dict[s]]                    
+    sa_list = [(s, a) for s in state_list for a in action_dict[s]]
     
     for t_i in transitions_list:
         forward_transitions.append({s:{a:([],[]) for a in action_dict[s]} 
                                     for s in state_list})
         backward_transitions.append({s: ([], []) for s in state_list})
+        # positions of the pick up destinations in the forward and backward
+        # transition lists, instead of searching the lists
+        forward_position = {}
+        backward_position = {}
         
         # action for queue_level > 0 is just to drop
         for s in state_list:                                                     
@@ -315,49 +317,31 @@ def transition_kernel_dict_flat(epsilon, transitions_list):
                 backward_transitions[-1][o_ind][1].append(1)
                 
             
-            # otherwise for the rides recorded:  
+            # otherwise for the rides recorded: destinations are merged by
+            # zone, at the position of their first appearance
+            existing_trans = forward_transitions[-1][o_ind][pu_action]
+            origin_sa = (o_ind, pu_action)
             for dest, p_ij in t_ij.items() :
                 # build forward transitions connection
-                existing_trans = forward_transitions[-1][o_ind][pu_action]
                 flat_dest = (dest[0], 0) 
-                # if o_ind == (48,0) and flat_dest == (4,0):
-                #     print(f'at {o_ind} -> {flat_dest}')
-                #     if flat_dest in existing_trans[0]:
-                #         dest_ind = existing_trans[0].index(flat_dest)
-                #         cur_forward_val = existing_trans[1][dest_ind]
-                #     else:
-                #         cur_forward_val = 0
-                #     print(f'cur_forward_P = {cur_forward_val}')
-                    
-                #     existing_backtrans = backward_transitions[-1][flat_dest]
-                #     origin_sa = (o_ind, pu_action)
-                #     if origin_sa in existing_backtrans:
-                #         orig_ind = existing_backtrans[0].index(origin_sa)
-                #         cur_back_val = existing_backtrans[1][orig_ind]
-                #     else:
-                #         cur_back_val = 0
-                #     print(f'backward_P = {cur_back_val}')
-                    
-                if flat_dest in existing_trans[0]:
-                    dest_ind = existing_trans[0].index(flat_dest)
+                if (o_ind, flat_dest) in forward_position:
+                    dest_ind = forward_position[(o_ind, flat_dest)]
                     existing_trans[1][dest_ind] += p_ij
-                    
                 else:
+                    forward_position[(o_ind, flat_dest)] = len(
+                        existing_trans[0])
                     existing_trans[0].append(flat_dest)
                     existing_trans[1].append(p_ij)
-                    # if o_ind == (48,0) and flat_dest == (4,0):
-                    #     print(f'appended {p_ij}')
                 # build backward_transition connection    
                 existing_backtrans = backward_transitions[-1][flat_dest]
-                origin_sa = (o_ind, pu_action)
-                if origin_sa in existing_backtrans[0]:
-                    osa_ind = existing_backtrans[0].index(origin_sa)
+                if (flat_dest, origin_sa) in backward_position:
+                    osa_ind = backward_position[(flat_dest, origin_sa)]
                     existing_backtrans[1][osa_ind] += p_ij
                 else:
+                    backward_position[(flat_dest, origin_sa)] = len(
+                        existing_backtrans[0])
                     existing_backtrans[0].append(origin_sa)
                     existing_backtrans[1].append(p_ij)
-                    # if o_ind == (48,0) and flat_dest == (4,0):
-                    #     print(f' backward append {p_ij}')
 
            
     for transition in forward_transitions:
@@ -371,6 +355,119 @@ def transition_kernel_dict_flat(epsilon, transitions_list):
     return forward_transitions, backward_transitions, state_list, action_dict, sa_list
 
 
+def transition_kernel_compiled(epsilon, transitions_list, flat=False,
+                               zone_neighbors=manhattan.zone_neighbors,
+                               shared=True, max_queue_level=None):
+    """ Build the dynamics of transition_kernel_dict (or of 
+    transition_kernel_dict_flat if flat) directly as a compiled_mdp.
+    
+    The kernels are assembled from (dest_state, origin_sa, probability)
+    triplets in one pass over the transitions, so the build time is linear 
+    in the number of nonzero transitions. The triplets of each state-action 
+    are in the order of transition_kernel_dict (the targeted neighbor 
+    first), which compiled_mdp.forward_dicts keeps.
+
+    Parameters
+    ----------
+    epsilon : float between (0, 1)
+        when choosing to go to neighboring state, probability of not 
+        getting there.
+    transitions_list : list
+        see transition_kernel_dict.
+    flat : bool, optional
+        If True, drivers have no queue levels. The default is False.
+    zone_neighbors : dict, optional
+        {zone_ind: [neighbor zone_ind]}, the zones of the model and their
+        adjacency. Every zone in transitions_list must be a key. The default
+        is manhattan_neighbors.zone_neighbors.
+    shared : bool, optional
+        If True, the time invariant transitions (going to neighbors and 
+        dropping queue levels) are stored once in the shared kernel of the 
+        compiled_mdp, and only the pick up transitions per time step. The 
+        default is True.
+    max_queue_level : int, optional
+        Number of queue levels of each zone. Every destination queue level 
+        in transitions_list must be below it. The default is 8 for 15 time 
+        steps and 7 otherwise.
+
+    Returns
+    -------
+    mdp: compiled_mdp, with state and state-action order of 
+        transition_kernel_dict.
+
+    """
+    pu_action = manhattan.most_neighbors(zone_neighbors)
+    if max_queue_level is None:
+        max_queue_level = 8 if len(transitions_list) == 15 else 7
+    if flat:
+        max_queue_level = 1
+    state_list = [(z_i, q_level) for z_i in zone_neighbors 
+                  for q_level in range(max_queue_level)]
+    action_dict = {}
+    for s in state_list:
+        action_dict[s] = [pu_action]
+        if s[1] == 0: # in the pick up queue - add go to neighbors action
+            action_dict[s] = list(range(len(zone_neighbors[s[0]])))
+            action_dict[s].append(pu_action)
+    state_index = {s: i for i, s in enumerate(state_list)}
+    sa_offsets = np.cumsum([0] + [len(action_dict[s]) for s in state_list])
+    S = len(state_list)
+    SA = sa_offsets[-1]
+    
+    # time invariant transitions: dropping queues and going to neighbors
+    rows, cols, probs = [], [], []
+    for s_ind, s in enumerate(state_list):
+        if s[1] > 0:
+            rows.append(state_index[(s[0], s[1] - 1)])
+            cols.append(sa_offsets[s_ind + 1] - 1)
+            probs.append(1)
+            continue
+        n_inds = [state_index[(n_j, 0)] for n_j in zone_neighbors[s[0]]]
+        total_neighbors = len(n_inds)
+        for a_ind, n_ind in enumerate(n_inds):
+            sa_ind = sa_offsets[s_ind] + a_ind
+            if epsilon > 0 and total_neighbors > 1:
+                rows.append(n_ind)
+                rows.extend([n_k for n_k in n_inds if n_k != n_ind])
+                cols.extend([sa_ind] * total_neighbors)
+                probs.append(1 - epsilon)
+                probs.extend([epsilon/(total_neighbors-1)] 
+                             * (total_neighbors - 1))
+            else:
+                rows.append(n_ind)
+                cols.append(sa_ind)
+                probs.append(1)
+    
+    shared_kernel = None
+    if shared:
+        shared_kernel = c_mdp.forward_kernel(rows, cols, probs, (S, SA))
+        rows, cols, probs = [], [], []
+    kernels = []
+    for t_i in transitions_list:
+        t_rows, t_cols, t_probs = list(rows), list(cols), list(probs)
+        for z_i, t_ij in t_i.items():
+            o_ind = state_index[(z_i, 0)] # queue level is 0
+            pu_ind = sa_offsets[o_ind + 1] - 1
+            if len(t_ij) == 0: # no rides recorded from z_i at time t_i
+                # go back to origin with probability 1.
+                t_rows.append(o_ind)
+                t_cols.append(pu_ind)
+                t_probs.append(1)
+            # destinations merged by queue level if flat, in order of first
+            # appearance as in transition_kernel_dict_flat
+            dest_probs = {}
+            for dest, p_ij in t_ij.items():
+                d_ind = state_index[(dest[0], 0) if flat else dest]
+                dest_probs[d_ind] = dest_probs.get(d_ind, 0) + p_ij
+            t_rows.extend(dest_probs.keys())
+            t_cols.extend([pu_ind] * len(dest_probs))
+            t_probs.extend(dest_probs.values())
+        kernels.append(c_mdp.forward_kernel(t_rows, t_cols, t_probs, 
+                                            (S, SA)))
+    return c_mdp.compiled_mdp(state_list, action_dict, kernels, 
+                              shared_kernel)
+
+
 def transition_kernel_pick_ups(epsilon, transitions_list):
     """
 
@@ -417,6 +514,9 @@ def transition_kernel_pick_ups(epsilon, transitions_list):
     for t_i in transitions_list:
         forward_transitions.append({})
         backward_transitions.append({})
+        # states whose queue drop is already in backward_transitions, 
+        # instead of searching the backward lists
+        dropped = set()
         for z_i, t_ij in t_i.items():
             o_ind = (z_i, 0) # queue level is 0
             if o_ind not in forward_transitions[-1]:
@@ -498,15 +598,11 @@ def transition_kernel_pick_ups(epsilon, transitions_list):
                 if dest not in backward_transitions[-1]:
                     backward_transitions[-1][dest] = ([],[])
                     
-                while queue_level >= 0 and \
-                    (origin, max_action) not in backward_transitions[-1][dest][0]:
-
+                while queue_level >= 0 and origin not in dropped:
+                    dropped.add(origin)
                     backward_transitions[-1][dest][0].append(
                         (origin, max_action))
                     backward_transitions[-1][dest][1].append(int(1))
-                    # if dest == (79, 0) and origin == (79,1):
-                    #     print(f' found {origin} -> {dest} at {transitions_list.index(t_i)}')
-                    #     print(f' value added is {backward_transitions[-1][dest][1][-1]}')
                     origin = dest   
                     queue_level += -1
                     dest = (origin[0], queue_level)
@@ -519,15 +615,19 @@ def transition_kernel_pick_ups(epsilon, transitions_list):
     return forward_transitions, backward_transitions
 
 
-def transition_kernel(T, epsilon):
+def transition_kernel(T, epsilon, sparse_kernel=False):
     """ Return a  4 dimensional transition kernel for Manhattan's MDP dynamics.
     
     Args: 
         T: total number of time steps within the MDP
         epsilon: the probability of not getting to neighbor state
+        sparse_kernel: if True, return the kernel as a compiled_mdp.
     Returns:
-        P: [T] x [S] x [S] x [A] transition kernel as ndarray.
+        P: [T] x [S] x [S] x [A] transition kernel as a read-only ndarray.
         P_{ts'sa} is the probability of transitioning to s' from (s,a) at t.
+        If sparse_kernel, P is a compiled_mdp over the states 0...S-1, each
+        with the actions 0...A, whose shared [S] x [S*A] kernel is the kernel
+        of every time step.
     """
     S = len(manhattan.STATE_NEIGHBORS)
     A = manhattan.most_neighbors(manhattan.STATE_NEIGHBORS)
@@ -553,10 +653,14 @@ def transition_kernel(T, epsilon):
             for other_n in neighbors:
                 P_t[other_n, state, action_ind] += p_other_neighbor
                 
-    P = np.zeros((T, S, S, A + 1))
-    for t in range(T):
-        P[t, :, :, :] = P_t
-    return P
+    if sparse_kernel:
+        # no transitions of their own at any time step
+        no_deltas = [sparse.csc_matrix((S, S * (A + 1)))] * T
+        return c_mdp.compiled_mdp(
+            range(S), {s: list(range(A + 1)) for s in range(S)}, no_deltas,
+            sparse.csc_matrix(P_t.reshape(S, -1)))
+    # every time step shares P_t: a read-only view instead of T copies
+    return np.broadcast_to(P_t, (T,) + P_t.shape)
             
 def test_transition_kernel(P):
     (T, S, _, A) = P.shape
@@ -11,7 +11,7 @@ With anaconda:
 @author: Sarah Li
 """
 import shapefile
-from shapely.geometry import Polygon
+from shapely.geometry import Polygon, shape as shape_geometry
 from descartes.patch import PolygonPatch
 import matplotlib as mpl
 import matplotlib.pyplot as plt
@@ -76,8 +76,9 @@ def get_lat_lon():
         content.append((loc_id, x, y))
     return pd.DataFrame(content, columns=[loc_id_str, lon_str, lat_str])
 
-def get_zone_locations(borough_str):
-    """ Return each zone's longitude/latitude as a dictionary of tuples."""
+def get_zone_locations(borough_str=None):
+    """ Return each zone's longitude/latitude as a dictionary of tuples.
+    If borough_str is None, return the zones of every borough."""
     attributes = _shape_file.records()
     shape_attributes = [dict(zip(_fields_name, attr)) for attr in attributes]
 
@@ -85,11 +86,55 @@ def get_zone_locations(borough_str):
     df_loc = pd.DataFrame(shape_attributes).join(
         get_lat_lon().set_index(id_str), 
         on=id_str)  
-    borough_only = df_loc[df_loc.borough == borough_str]
+    borough_only = df_loc
+    if borough_str is not None:
+        borough_only = df_loc[df_loc.borough == borough_str]
     zone_geography = {}
     for data in borough_only.itertuples():
         zone_geography[data.LocationID] = (data.latitude, data.longitude)
     return zone_geography
+
+
+def get_zone_neighbors(borough_str=None, tolerance=1e-5):
+    """ Return the adjacency graph of the zones of a borough (of every 
+    borough if borough_str is None) from the zone shapes.
+    
+    Args:
+        borough_str: name of the borough, see _borough_index.
+        tolerance: zones whose shapes are closer than tolerance (in degrees)
+            are neighbors.
+    Returns:
+        zone_neighbors: dict. {zone_ind: [neighbor zone_ind]}, in the format
+            of manhattan_neighbors.zone_neighbors. Zones without neighbors,
+            e.g. islands, have an empty list.
+    """
+    zone_shapes = {}
+    for shape_record in _shape_file.shapeRecords():
+        record = shape_record.record
+        if borough_str is not None and \
+            record[_shape_fields['borough']] != borough_str:
+            continue
+        zone = record[_shape_fields['LocationID']]
+        geometry = shape_geometry(shape_record.shape.__geo_interface__)
+        if zone in zone_shapes: # zones split over several records
+            geometry = zone_shapes[zone].union(geometry)
+        zone_shapes[zone] = geometry
+    zones = sorted(zone_shapes.keys())
+    bounds = np.array([zone_shapes[z].bounds for z in zones])
+    zone_neighbors = {z: [] for z in zones}
+    for i, z in enumerate(zones):
+        # only compare shapes with overlapping bounding boxes
+        overlaps = np.where(
+            (bounds[:, 0] <= bounds[i, 2] + tolerance) & 
+            (bounds[:, 2] >= bounds[i, 0] - tolerance) & 
+            (bounds[:, 1] <= bounds[i, 3] + tolerance) & 
+            (bounds[:, 3] >= bounds[i, 1] - tolerance))[0]
+        for j in overlaps[overlaps > i]:
+            n = zones[j]
+            if zone_shapes[z].distance(zone_shapes[n]) <= tolerance:
+                zone_neighbors[z].append(n)
+                zone_neighbors[n].append(z)
+    return {z: sorted(neighbors) for z, neighbors in zone_neighbors.items()}
     
     
 def draw_shape(ax, shape, color):
@@ -9,7 +9,7 @@ import numpy as np
 import seaborn as sea
 import matplotlib as mpl
 import matplotlib.pyplot as plt
-# import util.trip as manhattan
+import util.trip as trip
 import models.taxi_dynamics.manhattan_neighbors as m_neighs
 
 """ Format matplotlib output to be latex compatible with gigantic fonts."""
@@ -25,28 +25,22 @@ t_ints = [12, 15, 12, 15]
 
 for month, t_int in zip(months, t_ints):
     t_int_hr = t_int/60
-    trips_filename = directory+f'manhattan_trips_{month}.pickle'
+    trips_filename = directory+f'manhattan_trips_{month}.npz'
     output_filename = directory+f'manhattan_transitions_{month}_{t_int}min.pickle'
     print(f'opening file {trips_filename}')
-    trips_file = open(trips_filename, 'rb')
-    trips = pickle.load(trips_file)
-    trips_file.close()
+    trips = trip.load_trips(trips_filename)
     
     # get rid of all trips with time that are negative or too long
     print('removing negative trip times and >90 trip times.')
-    trip_times = [t.trip_time * 60 for t in trips]
-    avg_time = sum(trip_times) / len(trip_times) 
+    trip_times = trips['trip_time'] * 60
+    avg_time = np.mean(trip_times) 
     print(f' average trip time is {avg_time} ') # 13.28 for manhattan
     # process based on trip times:
-    # exclude longer than 1.5 hours
-    large_rides =[i for i, x in enumerate(trip_times) if x  > 90] 
-    # exclude negative times
-    negative_rides = [i for i, x in enumerate(trip_times) if x < 0]
-    
-    processed_trips = [trips[i] for i in range(len(trips)) 
-                       if i not in large_rides+negative_rides]
-    processed_trip_times = [t.trip_time * 60 for t in processed_trips]
-    avg_time = sum(processed_trip_times) / len(processed_trip_times) 
+    # exclude longer than 1.5 hours and negative times
+    kept_rides = (trip_times <= 90) & (trip_times >= 0)
+    processed_trips = trips[kept_rides]
+    processed_trip_times = processed_trips['trip_time'] * 60
+    avg_time = np.mean(processed_trip_times) 
     print(f' average processed trip time is {avg_time}') # 13.45 for processed manhattan
     
     # plot a histogram of the travelling times
@@ -68,35 +62,11 @@ for month, t_int in zip(months, t_ints):
         assert t_int in [12,15], 'give new time interval'
     time_bins = np.linspace(9, 12, total_time+1) # 15 min intervals
     
-    # sort trips by time    
-    processed_trips.sort(key=lambda x: x.putime) # sort trips by time
-    time_freqs, _ = np.histogram([t.putime for t in processed_trips], 
-                                      bins = time_bins)    
-    transitions = []
-    last_t_ind = 0
     max_q = 7 if t_int == 12 else 6
     assert t_int in [12, 15], 'give new maximum queue level'
-    
-    for t in range(total_time):
-        transitions.append({z: {} for z in zone_list})
-        print(f'\r on trip {last_t_ind}/{sum(time_freqs)}', end  = '  ')
-        trips_in_t = processed_trips[last_t_ind:last_t_ind+time_freqs[t]]
-        for trip in trips_in_t:
-            if trip.zone_pu in zone_list and trip.zone_do in zone_list:
-                trip_time = min(int(trip.trip_time/t_int_hr), max_q)
-                
-                dest_tuple = (trip.zone_do, trip_time)
-                if dest_tuple in transitions[-1][trip.zone_pu]: 
-                    transitions[-1][trip.zone_pu][dest_tuple] += 1
-                else:
-                    transitions[-1][trip.zone_pu][dest_tuple] = 1
-                
-        for pu_zone in zone_list:
-            total_trips = sum(list(transitions[-1][pu_zone].values()))
-            transitions[-1][pu_zone] = {k: v/total_trips  for k, v 
-                                        in transitions[-1][pu_zone].items()}          
-        last_t_ind += time_freqs[t]
-    print('')
+    transition_probabilities = trip.transition_arrays(
+        processed_trips, zone_list, time_bins, t_int_hr, max_q)
+    transitions = trip.transition_dicts(transition_probabilities, zone_list)
     
     """
     Transitions is a list of dictionaries, where the ith element is the dictionary
@@ -5,6 +5,8 @@ Created on Sat Aug  6 21:22:51 2022
 @author: Sarah Li
 """
 import numpy as np
+import models.compiled_mdp as c_mdp
+import algorithm.dynamic_programming as dp
 
 
 class queue_game:
@@ -35,10 +37,23 @@ class queue_game:
         self.action_dict = {(s, 0): [0, 7] for s in [1,2]}
         self.costs = [costs_t for _ in range(self.T)]
         self.max_q = 1
+        self.compiled = c_mdp.compile_transitions(
+            self.forward_P, self.state_list, self.action_dict)
         self.t0 = self.t0_density(uniform_density) 
         self.tolls = None
+        self.R, self.C = self.compiled.cost_arrays(self.costs)
+        self.toll_index = None
+        self.toll_value = None
         
     def get_potential(self, density):
+        if isinstance(density, np.ndarray):
+            potential_val = np.sum(0.5 * self.R * density**2 
+                                   + self.C * density)
+            if self.tolls is not None:
+                potential_val += self.toll_value.dot(
+                    density.reshape(-1)[self.toll_index]) - \
+                    self.constrained_val * sum(self.tolls.values())
+            return potential_val
         potential_val = sum([sum([0.5*c_t[sa][0]*d_t[sa]**2+c_t[sa][1]*d_t[sa]
                                   for sa in self.sa_list])
                              for c_t, d_t in zip(self.costs, density)])
@@ -51,6 +66,13 @@ class queue_game:
         return potential_val
     
     def get_social_cost(self, density):
+        if isinstance(density, np.ndarray):
+            potential_val = np.sum(self.R * density**2 + self.C * density)
+            if self.tolls is not None:
+                potential_val += self.toll_value.dot(
+                    density.reshape(-1)[self.toll_index]) - \
+                    self.constrained_val * sum(self.tolls.values())
+            return potential_val
         potential_val = sum([sum([c_t[sa][0]*d_t[sa]**2+c_t[sa][1]*d_t[sa]
                                   for sa in self.sa_list])
                              for c_t, d_t in zip(self.costs, density)])
@@ -66,6 +88,12 @@ class queue_game:
         return 0.5
     
     def get_gradient(self, density):
+        if isinstance(density, np.ndarray):
+            gradient = self.R * density + self.C
+            if self.tolls is not None:
+                np.add.at(gradient.reshape(-1), self.toll_index, 
+                          self.toll_value)
+            return gradient
         gradient = [{sa: c_t[sa][0]*d_t[sa]+c_t[sa][1] for sa in self.sa_list} 
                     for c_t, d_t in zip(self.costs, density)]
         if self.tolls is not None:
@@ -109,11 +137,10 @@ class queue_game:
         return initial_sa_density
     
     def propagate(self, sa_density, t):
-        # for s, val in self.backward_P[t].items():
-        #     for orig_s, prob in zip(val[0],val[1]):
-        #         print(f' orig_s {orig_s}')
-        #         print(f' prob {prob}')
-        # print(f'sa density {sa_density}')
+        if isinstance(sa_density, np.ndarray):
+            return self.compiled.propagate(sa_density, t)
+        # dictionary densities go through backward_P, independently of the
+        # compiled kernels, so they can be checked against each other.
         next_density = {s: sum([prob* sa_density[orig_s] 
                                 for orig_s, prob in zip(val[0],val[1])]) 
                         for s, val in self.backward_P[t].items()}
@@ -164,7 +191,72 @@ class queue_game:
         else:
             return gradient
         
+    def toll_array(self, tau):
+        toll_index, toll_value = self.compiled.toll_arrays(tau)
+        tolls = np.zeros((self.T, self.compiled.SA))
+        np.add.at(tolls.reshape(-1), toll_index, toll_value)
+        return tolls
+        
     def update_tolls(self, tau):
         self.tolls = {}
         for k in tau.keys():
-            self.tolls[k] = tau[k]   
\ No newline at end of file
+            self.tolls[k] = tau[k]
+        self.toll_index, self.toll_value = self.compiled.toll_arrays(
+            self.tolls)
+   
+
+def test_array_paths(game, forward_P=None):
+    """ Assert that the compiled array paths of game match its dictionary 
+    paths: the compiled transitions, value iteration, policy and densities.
+    
+    Input:
+        game: a queue_game object.
+        forward_P: forward transition dictionaries to compare the compiled
+            transitions to, entry for entry and in order. The default is 
+            game.forward_P.
+    """
+    mdp = game.compiled
+    if forward_P is None:
+        forward_P = game.forward_P
+    compiled_P = mdp.forward_dicts()
+    for t in range(len(forward_P)):
+        for s in forward_P[t].keys():
+            for a, P_tsa in forward_P[t][s].items():
+                assert compiled_P[t][s][a] == P_tsa, \
+                    f'compiled transitions of {(s, a)} at time {t} are ' \
+                    f'{compiled_P[t][s][a]} != {P_tsa}'
+    print('compiled transitions match the dictionary transitions')
+    
+    density = game.get_density()
+    grad = game.get_gradient(density)
+    V, pol = dp.value_iteration_dict(grad, forward_P)
+    V_array, pol_array = dp.value_iteration_dict(mdp.sa_array(grad), mdp)
+    for t in range(len(V)):
+        for s in mdp.state_list:
+            V_ts = V_array[t, mdp.state_index[s]]
+            assert round(V[t][s] - V_ts, 5) == 0, \
+                f'value of {s} at time {t} is {V_ts} != {V[t][s]}'
+    assert mdp.policy_dicts(pol_array) == pol, \
+        'array policy does not match the dictionary policy'
+    print('array value iteration matches the dictionary value iteration')
+    
+    for t in range(len(density)):
+        next_density = game.propagate(density[t], t)
+        next_array = mdp.propagate(mdp.sa_vector(density[t]), t)
+        assert np.allclose(mdp.s_vector(next_density), next_array), \
+            f'array propagation at time {t} does not match the dictionary ' \
+            'propagation'
+    print('array propagation matches the dictionary propagation')
+    
+    sa_density, s_density = dp.density_retrieval(pol, game)
+    sa_array, s_array = dp.density_retrieval(pol_array, game)
+    assert np.allclose(mdp.sa_array(sa_density), sa_array), \
+        'array state-action density does not match the dictionary density'
+    assert np.allclose(np.array([mdp.s_vector(s_t) for s_t in s_density]), 
+                       s_array), \
+        'array state density does not match the dictionary density'
+    print('array density retrieval matches the dictionary density retrieval')
+
+
+if __name__ == '__main__':
+    test_array_paths(queue_game(total_mass=10))
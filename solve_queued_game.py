@@ -17,7 +17,7 @@ mass = 10000
 manhattan_game = queued_game.queue_game(mass, 0.01, uniform_density=True, 
                                         flat=False)
 constrained_value = 350 
-T = len(manhattan_game.forward_P)
+T = manhattan_game.T
 initial_density = manhattan_game.get_density()
 y_res, obj_hist = fw.FW_dict(manhattan_game, 
                              max_error=1000, max_iterations=1e3)
@@ -25,6 +25,10 @@ constrained_value = 350 # 350  for flat # maximum driver density per state
 max_errors = [1000]#[10000, 5000, 1000, 500, 100]
 max_iterations = 1000 # number of iterations of dual ascent
 toll_queues = False
+# start each equilibrium solve from the last one. This switches FW_dict to the
+# exact step, whose error is the Frank-Wolfe gap rather than the open loop
+# error, so max_errors must be rescaled before comparing to earlier results.
+warm_start = False
 save_last_toll_results = True
 save_plots = True
 # game definition with initial distribution
@@ -65,7 +69,7 @@ print(f'before tolling: violation_density = {violation_norm}')
 # and the constraint norm
 alpha = manhattan_game.get_strong_convexity()
 print(f'convexity factor is {alpha}')
-T = len(manhattan_game.forward_P)
+T = manhattan_game.T
 Z = len(constrained_zones)
 ZA = sum([len(manhattan_game.action_dict[(z, 0)]) for z in constrained_zones])
 A_arr = np.zeros((T*Z, ZA*T))  
@@ -107,13 +111,14 @@ for err in max_errors:
     last_violation = []
     social_cost = []
     last_tau_norm = []
+    fw_solver = pga.warm_start_solver(manhattan_game, max_iterations, 
+                                      initial_density, warm_start=warm_start,
+                                      verbose=False, keep_history=False)
     # define dual ascent approximate gradient update.
     # input approx_err comes from inexact_pga
     def approx_gradient(game, cur_tau, approx_err, k): 
-        game.update_tolls(cur_tau)
         # solve first game
-        approx_y, obj_hist = fw.FW_dict(game, approx_err, max_iterations, 
-                                        initial_density, verbose=False) 
+        approx_y, obj_hist = fw_solver.solve(cur_tau, approx_err)
 
         last_distribution.append(approx_y[-1])
         for t in range(T):
@@ -139,6 +144,8 @@ for err in max_errors:
                                               max_iterations, 
                                               epsilons=[err]*100000, 
                                               verbose = False)
+    print('')
+    print(f'total Frank-Wolfe oracle calls {fw_solver.oracle_calls}')
     # find average tau value
     tau_values = []
     average_tau = {z: 0 for z in tau_hist[-1].keys()}
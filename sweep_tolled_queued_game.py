@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 09:02:47 2026
+
+Run the tolled queued game over a grid of scenario parameters. Each scenario
+builds a queue_game and designs its tolls with inexact projected gradient
+ascent, as in solve_tolled_queued_game.py. Scenarios are solved in parallel
+in a process pool, and every worker process builds each game only once.
+
+@author: Sarah Li
+"""
+import concurrent.futures as futures
+import itertools
+import numpy as np
+import algorithm.inexact_projected_gradient_ascent as pga
+import models.queued_mdp_game as queued_game
+
+
+# parameters that define a queue_game, the rest define the toll design
+game_parameters = ['mass', 'epsilon', 'flat', 'month', 'ints',
+                   'uniform_density']
+default_scenario = {
+    'mass': 10000, # game population size
+    'epsilon': 0.01, # probability of not reaching the targeted neighbor
+    'flat': False,
+    'month': 'jan',
+    'ints': 15, # minutes per time step
+    'uniform_density': True,
+    'constrained_zones': (161, 162, 236, 237),
+    'constrained_value': 350, # maximum driver density per state
+    'max_error': 1000, # accuracy of each equilibrium solve
+    'max_iterations': 1000, # number of iterations of dual ascent
+    # True uses the exact step, whose error is the Frank-Wolfe gap, so
+    # max_error would not match the cold start tolerances
+    'warm_start': False,
+    'seed': None,
+    }
+_games = {} # games built in this process, keyed by game parameters
+
+
+def scenario_grid(**grid):
+    """ Return the scenarios of the cartesian product of the parameter lists
+    in grid, e.g. scenario_grid(max_error=[1000, 100], ints=[12, 15]).
+    Parameters not in grid take their value from default_scenario."""
+    keys = list(grid.keys())
+    scenarios = []
+    for values in itertools.product(*[grid[k] for k in keys]):
+        scenario = dict(default_scenario)
+        scenario.update(zip(keys, values))
+        scenarios.append(scenario)
+    return scenarios
+
+
+def get_game(scenario):
+    """ Return the queue_game of a scenario, building it only once per
+    process."""
+    key = tuple(scenario[p] for p in game_parameters)
+    if key not in _games:
+        _games[key] = queued_game.queue_game(
+            scenario['mass'], scenario['epsilon'],
+            uniform_density=scenario['uniform_density'],
+            flat=scenario['flat'], month=scenario['month'],
+            ints=scenario['ints'])
+    return _games[key]
+
+
+def dual_step_size(game, constrained_zones):
+    """ Step size alpha / |A|_2^2 of the dual ascent, where alpha is the
+    strong convexity of the game and A sums the actions of the constrained
+    zones at each time, so that |A|_2^2 is the most actions of a
+    constrained zone."""
+    alpha = game.get_strong_convexity()
+    most_actions = max([len(game.action_dict[(z, 0)])
+                        for z in constrained_zones])
+    return alpha / most_actions
+
+
+def run_scenario(scenario):
+    """ Design the tolls of one scenario.
+
+    Returns:
+        result: dict. The scenario, the final tolls 'tau', the traces
+            'last_violation', 'avg_violation' and 'social_cost' over the dual
+            ascent iterations, and the total Frank-Wolfe 'oracle_calls'.
+    """
+    if scenario['seed'] is not None:
+        np.random.seed(scenario['seed'])
+    game = get_game(scenario)
+    mdp = game.compiled
+    game.tolls = None
+    initial_density = game.get_density()
+    constrained_zones = list(scenario['constrained_zones'])
+    game.set_constraints(constrained_zones, scenario['constrained_value'])
+    tau = {((z, 0), t): 0 for z in constrained_zones for t in range(game.T)}
+
+    fw_solver = pga.warm_start_solver(
+        game, scenario['max_iterations'], initial_density,
+        warm_start=scenario['warm_start'], verbose=False,
+        keep_history=False)
+    avg_distribution = np.zeros((game.T, mdp.SA))
+    last_violation = []
+    avg_violation = []
+    social_cost = []
+    def approx_gradient(game, cur_tau, approx_err, k):
+        approx_y, _ = fw_solver.solve(cur_tau, approx_err)
+        avg_distribution[:] = (avg_distribution * k
+                               + mdp.sa_array(approx_y[-1])) / (k + 1)
+        gradient, violation = game.get_constrained_gradient(
+            approx_y[-1], return_violation=True)
+        _, avg_violation_k = game.get_constrained_gradient(
+            mdp.sa_dicts(avg_distribution), return_violation=True)
+        last_violation.append(violation)
+        avg_violation.append(avg_violation_k)
+        social_cost.append(game.get_social_cost(avg_distribution))
+        return gradient
+
+    step_size = dual_step_size(game, constrained_zones)
+    tau_hist, _ = pga.inexact_pga(
+        game, tau, approx_gradient, step_size, scenario['max_iterations'],
+        epsilons=[scenario['max_error']] * scenario['max_iterations'])
+    return {'scenario': scenario,
+            'tau': tau_hist[-1],
+            'last_violation': last_violation,
+            'avg_violation': avg_violation,
+            'social_cost': social_cost,
+            'oracle_calls': fw_solver.oracle_calls}
+
+
+def run_sweep(scenarios, max_workers=None):
+    """ Run the scenarios in a process pool of max_workers processes (the
+    number of processors if None). Results are returned in scenario order.
+    """
+    with futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(run_scenario, scenarios))
+    return results
+
+
+if __name__ == '__main__':
+    scenarios = scenario_grid(max_error=[10000, 5000, 1000, 500, 100],
+                              constrained_value=[300, 350, 400])
+    results = run_sweep(scenarios)
+    for result in results:
+        scenario = result['scenario']
+        print(f'max error {scenario["max_error"]}, constrained value '
+              f'{scenario["constrained_value"]}: average violation '
+              f'{result["avg_violation"][-1]}, oracle calls '
+              f'{result["oracle_calls"]}')
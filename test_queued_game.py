@@ -5,6 +5,7 @@ Created on Tue Jul 26 13:47:27 2022
 @author: Sarah Li
 """
 import models.taxi_dynamics.manhattan_neighbors as m_neighs
+import models.taxi_dynamics.manhattan_transition as m_trans
 import numpy as np
 import models.queued_mdp_game as game
 import algorithm.dynamic_programming as dp
@@ -15,6 +16,7 @@ import models.test_model as test
 
             
 mass = 10000
+epsilon = 0.1
 flat = False
 is_test = False
 if is_test: 
@@ -22,7 +24,7 @@ if is_test:
     manhattan_game = test.queue_game(mass, uniform_density=True)
 else:
     neighbor_list = m_neighs.zone_neighbors
-    manhattan_game = game.queue_game(mass, 0.1, uniform_density=True, 
+    manhattan_game = game.queue_game(mass, epsilon, uniform_density=True, 
                                      flat=flat)
 
 
@@ -106,6 +108,18 @@ for dest, orig in backward_P[check_ind].items():
             f'{orig[1][i]} != {forward_probability} at time {check_ind}'
 print('all tests for backward transition passed')
 
+#%% Test the compiled game against the dictionary game %%#
+# the compiled transitions must equal the dictionary transitions entry for
+# entry and in order, e.g. the targeted neighbor is the first destination.
+dict_forward_P = None
+if not is_test:
+    kernel_dict = m_trans.transition_kernel_dict_flat if flat \
+        else m_trans.transition_kernel_dict
+    dict_forward_P = kernel_dict(epsilon, manhattan_game.transition_data)[0]
+    assert forward_P == dict_forward_P, \
+        'forward transitions do not match transition_kernel_dict'
+test.test_array_paths(manhattan_game, dict_forward_P)
+
 #%% Test the initial densities %%#
 def test_density(d_list, mass, game):
     
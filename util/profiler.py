@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:05:37 2026
+
+Per-phase wall time and counters of the solvers. FW_dict, FW_active_set,
+FW_batch, value_iteration_dict, density_retrieval and inexact_pga take an
+optional profiler and time their phases with profiler.phase(name), e.g.
+
+    with profiler() as prof:
+        fw.FW_dict(game, max_error, max_iterations, profiler=prof)
+    print(prof.summary())
+    prof.dump('fw_profile.json')
+
+Without a profiler the solvers use `disabled`, whose phases and counters do
+nothing, so the hooks cost one attribute lookup and an empty with block.
+
+@author: Sarah Li
+"""
+import json
+import time
+import tracemalloc
+
+
+class _phase:
+    """ Context manager that adds its wall time to a phase of a profiler."""
+    __slots__ = ('_profiler', '_name', '_start', '_memory')
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        if self._profiler.track_memory:
+            self._memory = self._profiler._memory_enter()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self._start
+        allocated = 0
+        if self._profiler.track_memory:
+            allocated = self._profiler._memory_exit(self._memory)
+        self._profiler._record(self._name, elapsed, allocated)
+        return False
+
+
+class profiler:
+    """ Wall time per phase and counters of a solver run.
+
+    Args:
+        track_memory: bool. If True, tracemalloc measures the bytes
+            allocated in each phase, as the peak traced memory of the phase
+            above the traced memory at its start. This slows the run down.
+    Attributes:
+        phases: dict. {name: {'calls': int, 'time': seconds,
+            'bytes_allocated': int}}, in order of first use.
+        counters: dict. {name: count}, e.g. oracle calls or states touched.
+        wall_time: seconds between entering and exiting the profiler, or
+            None if it was not used as a context manager.
+    """
+    enabled = True
+
+    def __init__(self, track_memory=False):
+        self.track_memory = track_memory
+        self.phases = {}
+        self.counters = {}
+        self.wall_time = None
+        self._start = None
+        self._memory_stack = []
+        self._started_tracemalloc = False
+
+    def __enter__(self):
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall_time = time.perf_counter() - self._start
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        return False
+
+    def phase(self, name):
+        """ Return a context manager that times the phase name."""
+        return _phase(self, name)
+
+    def count(self, name, value=1):
+        """ Add value to the counter name."""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def _record(self, name, elapsed, allocated):
+        if name not in self.phases:
+            self.phases[name] = {'calls': 0, 'time': 0., 'bytes_allocated': 0}
+        phase = self.phases[name]
+        phase['calls'] += 1
+        phase['time'] += elapsed
+        phase['bytes_allocated'] += allocated
+
+    def _memory_enter(self):
+        """ Start measuring the allocations of a phase. Returns its frame
+        [memory at start, peak memory], and passes the peak so far on to
+        the enclosing phases before the tracemalloc peak is reset."""
+        current, peak = tracemalloc.get_traced_memory()
+        for frame in self._memory_stack:
+            frame[1] = max(frame[1], peak)
+        tracemalloc.reset_peak()
+        frame = [current, current]
+        self._memory_stack.append(frame)
+        return frame
+
+    def _memory_exit(self, frame):
+        """ Return the bytes allocated at the peak of the phase of frame."""
+        _, peak = tracemalloc.get_traced_memory()
+        self._memory_stack.remove(frame)
+        frame[1] = max(frame[1], peak)
+        for outer in self._memory_stack:
+            outer[1] = max(outer[1], frame[1])
+        return frame[1] - frame[0]
+
+    def to_dict(self):
+        return {'wall_time': self.wall_time, 'phases': self.phases,
+                'counters': self.counters}
+
+    def dump(self, filename):
+        """ Save the phases and counters as JSON."""
+        with open(filename, 'w') as json_file:
+            json.dump(self.to_dict(), json_file, indent=2)
+
+    def summary(self):
+        """ Return a table of the phases and counters. Phases may be nested,
+        e.g. the Frank-Wolfe phases inside the gradient oracle of
+        inexact_pga, so their share of the wall time can sum to over 100%.
+        """
+        total = self.wall_time
+        if total is None:
+            total = sum([phase['time'] for phase in self.phases.values()])
+        lines = [f'{"phase":<24}{"calls":>10}{"total s":>12}'
+                 f'{"mean ms":>12}{"% wall":>9}'
+                 + (f'{"alloc MB":>12}' if self.track_memory else '')]
+        for name, phase in self.phases.items():
+            line = (f'{name:<24}{phase["calls"]:>10}{phase["time"]:>12.4f}'
+                    f'{1e3 * phase["time"] / phase["calls"]:>12.4f}'
+                    f'{100 * phase["time"] / max(total, 1e-12):>9.1f}')
+            if self.track_memory:
+                line += f'{phase["bytes_allocated"] / 2**20:>12.2f}'
+            lines.append(line)
+        if self.wall_time is not None:
+            lines.append(f'{"wall time":<24}{"":>10}{self.wall_time:>12.4f}')
+        for name, value in self.counters.items():
+            lines.append(f'{name:<24}{value:>10}')
+        return '\n'.join(lines)
+
+
+class _null_phase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class null_profiler:
+    """ Profiler whose phases and counters do nothing."""
+    enabled = False
+    _phase = _null_phase()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def phase(self, name):
+        return self._phase
+
+    def count(self, name, value=1):
+        pass
+
+
+disabled = null_profiler()
+
+
+def get(prof):
+    """ Return prof, or the disabled profiler if prof is None."""
+    return disabled if prof is None else prof
@@ -2,15 +2,14 @@
 """
 Created on Tue Jan  5 22:26:37 2021
 
-Extract a trip from a CSV row.
+Extract a trip from a CSV row, or a TripBatch of trips from the columns of
+a TLC file.
 
 @author: Nico Miguel, Sarah Li
 """
 import datetime
-
-#%% memes %%#
-
-import models.taxi_dynamics.visualization as visual
+import numpy as np
+import pandas as pd
 
 
 Man_zones = [4,  12,  13,  24,  41,  42,  43,  45,  48,  50,  68,  74,  75,
@@ -90,3 +89,314 @@ class Trip:
         # Cost of ride
         self.fare = trip_instance[10]
         
+        
+
+# TLC columns of the trip fields, in the order of TripBatch.from_columns
+tlc_columns = ['tpep_pickup_datetime', 'tpep_dropoff_datetime', 
+               'PULocationID', 'DOLocationID', 'fare_amount']
+
+
+def hours_of_day(timestamps):
+    """ Return the time in hours since the beginning of the day of each 
+    timestamp, truncated to the minute as in Trip.putime.
+    
+    Args:
+        timestamps: array or pandas Series of datetimes or of 
+            'YYYY-MM-DD HH:MM:SS' strings.
+    """
+    stamps = pd.to_datetime(timestamps).values
+    minutes = (stamps - stamps.astype('datetime64[D]')).astype(
+        'timedelta64[m]').astype(np.int64)
+    return minutes / 60
+
+
+# one record of a TripBatch, times are in hours since the beginning of the
+# day and the trip distance is NaN if unknown.
+trip_dtype = np.dtype([('zone_pu', np.int16), ('zone_do', np.int16), 
+                       ('putime', np.float32), ('dotime', np.float32), 
+                       ('trip_time', np.float32), ('fare', np.float32), 
+                       ('trip_distance', np.float32)])
+
+
+class TripView:
+    """ One trip of a TripBatch, with the attributes of Trip."""
+    __slots__ = ('_record',)
+    
+    def __init__(self, record):
+        self._record = record
+        
+    def __getattr__(self, field):
+        if field not in trip_dtype.names:
+            raise AttributeError(field)
+        return self._record[field].item()
+    
+    
+class TripBatch:
+    
+    def __init__(self, records):
+        """ A set of trips stored as a structured array of trip_dtype.
+        
+        Fields are read as columns with batch[field], and indexing with an 
+        int returns a TripView, with a mask, slice or index array returns a
+        TripBatch.
+        """
+        self.records = records
+        
+    @classmethod
+    def from_columns(cls, pickup_times, dropoff_times, zone_pu, zone_do, 
+                     fare, trip_distance=None):
+        """ Build the trips from the columns of a TLC file.
+        
+        Args:
+            pickup_times, dropoff_times: timestamps, see hours_of_day.
+            zone_pu, zone_do: pick up and drop off zone of each trip.
+            fare: cost of each ride.
+            trip_distance: optional, distance of each ride in miles.
+        """
+        records = np.empty(len(zone_pu), dtype=trip_dtype)
+        records['zone_pu'] = zone_pu
+        records['zone_do'] = zone_do
+        putime = hours_of_day(pickup_times)
+        dotime = hours_of_day(dropoff_times)
+        records['putime'] = putime
+        records['dotime'] = dotime
+        records['trip_time'] = dotime - putime
+        records['fare'] = fare
+        records['trip_distance'] = np.nan
+        if trip_distance is not None:
+            records['trip_distance'] = trip_distance
+        return cls(records)
+    
+    @classmethod
+    def concatenate(cls, batches):
+        """ Return the trips of a list of TripBatches."""
+        return cls(np.concatenate([batch.records for batch in batches]))
+    
+    def __len__(self):
+        return len(self.records)
+    
+    def __getitem__(self, index):
+        if isinstance(index, str):
+            return self.records[index]
+        if isinstance(index, (int, np.integer)):
+            return TripView(self.records[index])
+        return TripBatch(self.records[index])
+    
+    def __iter__(self):
+        return (TripView(record) for record in self.records)
+
+
+def select_trips(trips, zones, start_hour, end_hour):
+    """ Return the TripBatch of trips between zones that are picked up in 
+    the open time window (start_hour, end_hour)."""
+    mask = (np.isin(trips['zone_pu'], zones) & np.isin(trips['zone_do'], zones) 
+            & (trips['putime'] > start_hour) & (trips['putime'] < end_hour))
+    return trips[mask]
+
+
+def read_columns(filename, columns, chunk_size=1000000):
+    """ Read only the given columns of a TLC .parquet or .csv file.
+    
+    Args:
+        filename: name of the .parquet or .csv file.
+        columns: list of column names.
+        chunk_size: maximum number of rows read at once.
+    Returns:
+        chunks: generator of pandas DataFrames with at most chunk_size rows.
+    """
+    if filename.endswith('.parquet'):
+        # pyarrow is an optional dependency, only needed for parquet files
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError(f'reading {filename} needs the optional '
+                              'dependency pyarrow, pip install pyarrow or '
+                              'use the .csv trip files.') from None
+        parquet_file = pq.ParquetFile(filename)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, 
+                                               columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(filename, header=0, usecols=columns, 
+                               chunksize=chunk_size)
+
+
+class trip_counter:
+    
+    def __init__(self, zones, time_bins):
+        """ Incremental pick up counts and trip distance sums per time 
+        partition and pick up zone.
+        
+        Args:
+            zones: list of zones.
+            time_bins: edges of the time partitions in hours, the partitions
+                are [time_bins[t], time_bins[t+1]).
+        """
+        self.zones = np.unique(zones)
+        self.time_bins = np.asarray(time_bins)
+        shape = (len(self.time_bins) - 1, len(self.zones))
+        self.counts = np.zeros(shape, dtype=np.int64)
+        self.distance = np.zeros(shape)
+        
+    def update(self, trips):
+        """ Add a TripBatch. Trips outside the zones or the time partitions
+        are ignored, unknown trip distances count as 0."""
+        T, Z = self.counts.shape
+        # compare in the precision of the trip times
+        time_bins = self.time_bins.astype(trips['putime'].dtype)
+        t_ind = np.searchsorted(time_bins, trips['putime'], side='right') - 1
+        z_ind = np.minimum(np.searchsorted(self.zones, trips['zone_pu']), 
+                           Z - 1)
+        valid = ((t_ind >= 0) & (t_ind < T) 
+                 & (self.zones[z_ind] == trips['zone_pu']))
+        index = t_ind[valid] * Z + z_ind[valid]
+        self.counts += np.bincount(index, minlength=T*Z).reshape(T, Z)
+        self.distance += np.bincount(
+            index, weights=np.nan_to_num(trips['trip_distance'][valid]), 
+            minlength=T*Z).reshape(T, Z)
+                
+    def average_distance(self):
+        """ Return the average trip distance per time partition and pick up
+        zone, 0 where there are no trips."""
+        return np.divide(self.distance, self.counts, 
+                         out=np.zeros(self.counts.shape), 
+                         where=self.counts > 0)
+
+
+def stream_trips(filename, zones, start_hour, end_hour, counters=(), 
+                 chunk_size=1000000):
+    """ Read the trips of a TLC file chunk by chunk, so that memory is 
+    bounded by chunk_size and by the selected trips.
+    
+    Args:
+        filename: name of the .parquet or .csv file.
+        zones, start_hour, end_hour: trips to keep, see select_trips.
+        counters: list of trip_counters updated with the kept trips.
+        chunk_size: maximum number of rows read at once.
+    Returns:
+        trips: TripBatch of the kept trips, with their trip distance.
+    """
+    kept = []
+    for frame in read_columns(filename, tlc_columns + ['trip_distance'], 
+                              chunk_size):
+        trips = TripBatch.from_columns(*[frame[c] for c in tlc_columns], 
+                                       trip_distance=frame['trip_distance'])
+        trips = select_trips(trips, zones, start_hour, end_hour)
+        for counter in counters:
+            counter.update(trips)
+        kept.append(trips)
+    return TripBatch.concatenate(kept)
+
+
+def zone_indices(zone_ids, zones):
+    """ Return the index in zones of each zone id, -1 if it is not in zones.
+    """
+    zones = np.asarray(zones)
+    order = np.argsort(zones)
+    positions = np.minimum(np.searchsorted(zones[order], zone_ids), 
+                           len(zones) - 1)
+    return np.where(zones[order][positions] == zone_ids, order[positions], -1)
+
+
+def partition_indices(trips, time_bins):
+    """ Return the time partition of each trip's pick up time, as 
+    np.histogram with bins time_bins: the last partition is closed, and 
+    trips outside of the edges are -1 or len(time_bins) - 1. Edges are 
+    compared in the precision of the trip times."""
+    putime = trips['putime']
+    time_bins = np.asarray(time_bins).astype(putime.dtype)
+    t_ind = np.searchsorted(time_bins, putime, side='right') - 1
+    t_ind[putime == time_bins[-1]] = len(time_bins) - 2
+    return t_ind
+
+
+def od_matrices(trips, zones, time_bins):
+    """ Origin-destination trip counts and probabilities per time partition.
+    
+    Args:
+        trips: TripBatch.
+        zones: list of zones, trips from or to other zones are ignored.
+        time_bins: edges of the time partitions in hours, see 
+            partition_indices.
+    Returns:
+        count_matrix: int array with shape (T, Z, Z), [t, o, d] is the 
+            number of trips from zones[o] to zones[d] picked up in 
+            partition t.
+        state_matrix: array with shape (T, Z, Z), count_matrix normalized 
+            per origin. Origins without trips are zero rows.
+    """
+    T = len(time_bins) - 1
+    Z = len(zones)
+    t_ind = partition_indices(trips, time_bins)
+    o_ind = zone_indices(trips['zone_pu'], zones)
+    d_ind = zone_indices(trips['zone_do'], zones)
+    valid = (t_ind >= 0) & (t_ind < T) & (o_ind >= 0) & (d_ind >= 0)
+    index = (t_ind[valid] * Z + o_ind[valid]) * Z + d_ind[valid]
+    count_matrix = np.bincount(index, minlength=T*Z*Z).reshape(T, Z, Z)
+    totals = count_matrix.sum(axis=2, keepdims=True)
+    state_matrix = np.divide(count_matrix, totals, 
+                             out=np.zeros(count_matrix.shape), 
+                             where=totals > 0)
+    return count_matrix, state_matrix
+
+
+def transition_arrays(trips, zones, time_bins, level_length, max_level):
+    """ Trip transition probabilities between zones per time partition.
+    
+    Args:
+        trips: TripBatch.
+        zones: list of zones, trips from or to other zones are ignored.
+        time_bins: edges of the time partitions in hours, see 
+            partition_indices. Trips picked up outside of the edges are 
+            ignored.
+        level_length: length of a trip time level in hours.
+        max_level: trips longer than max_level levels are at max_level.
+    Returns:
+        probabilities: array with shape (T, Z, Z, max_level + 1), 
+            [t, o, d, l] is the probability that a trip picked up in zones[o]
+            in partition t goes to zones[d] with trip time level l. Rows 
+            without trips are zero.
+    """
+    zones = np.asarray(zones)
+    T = len(time_bins) - 1
+    Z = len(zones)
+    L = max_level + 1
+    t_ind = partition_indices(trips, time_bins)
+    o_ind = zone_indices(trips['zone_pu'], zones)
+    d_ind = zone_indices(trips['zone_do'], zones)
+    # trip times are whole minutes, round off the float error before flooring
+    levels = np.minimum(np.floor(np.round(trips['trip_time'] / level_length, 
+                                          4)), max_level).astype(np.int64)
+    valid = (t_ind >= 0) & (t_ind < T) & (o_ind >= 0) & (d_ind >= 0)
+    index = ((t_ind[valid] * Z + o_ind[valid]) * Z + d_ind[valid]) * L \
+        + levels[valid]
+    counts = np.bincount(index, minlength=T*Z*Z*L).reshape(T, Z, Z, L)
+    totals = counts.sum(axis=(2, 3), keepdims=True)
+    return np.divide(counts, totals, out=np.zeros(counts.shape), 
+                     where=totals > 0)
+
+
+def transition_dicts(probabilities, zones):
+    """ Convert transition_arrays to the transitions list of 
+    manhattan_transition.transition_kernel_dict.
+    
+    Returns:
+        transitions: list. [t_i] for each time partition.
+            t_i: dict. {z: {(dest_zone, level): p}} for z in zones.
+    """
+    zones = np.asarray(zones).tolist()
+    transitions = [{z: {} for z in zones} for _ in probabilities]
+    for t, o, d, l in zip(*[ind.tolist() for ind in np.nonzero(probabilities)]):
+        transitions[t][zones[o]][(zones[d], l)] = probabilities[t, o, d, l]
+    return transitions
+
+
+def save_trips(filename, trips):
+    """ Save a TripBatch to an .npz file."""
+    np.savez(filename, trips=trips.records)
+
+
+def load_trips(filename):
+    """ Load a TripBatch saved with save_trips."""
+    with np.load(filename) as trips_file:
+        return TripBatch(trips_file['trips'])